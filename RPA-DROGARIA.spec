@@ -13,7 +13,7 @@ a = Analysis(
     pathex=[str(base_dir)],
     binaries=[],
     datas=[('config.ini', '.')],
-    hiddenimports=[],
+    hiddenimports=['python_calamine', 'xlrd'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,195 @@
+"""
+Benchmarks das etapas vetorizadas da conciliacao (dados sinteticos, sem depender da rede).
+Uso: python bench_conciliacao.py
+"""
+
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+from conciliacao import (
+    STATUS_CATEGORIAS,
+    agregar_por_nota,
+    converter_para_float,
+    converter_para_float_serie,
+    gravar_tabela,
+    juntar_por_nota,
+)
+
+
+def _medir(fn, repeticoes: int = 3) -> float:
+    melhor = float("inf")
+    for _ in range(repeticoes):
+        ini = time.perf_counter()
+        fn()
+        melhor = min(melhor, time.perf_counter() - ini)
+    return melhor
+
+
+def _coluna_valores(n: int, seed: int = 0) -> pd.Series:
+    """Coluna no formato lido do Excel: maioria numerica, parte em texto BR/US, vazios e lixo de cabecalho."""
+    rng = np.random.default_rng(seed)
+    centavos = rng.integers(100, 5_000_000, n)
+    tipo = rng.random(n)
+    valores = []
+    for c, r in zip(centavos, tipo):
+        if r < 0.70:
+            valores.append(c / 100)
+        elif r < 0.85:
+            valores.append(f"{c // 100:,}".replace(",", ".") + f",{c % 100:02d}")
+        elif r < 0.90:
+            valores.append(f"{c // 100:,}.{c % 100:02d}")
+        elif r < 0.95:
+            valores.append(None)
+        else:
+            valores.append(" ")
+    return pd.Series(valores, dtype=object)
+
+
+def bench_valores(n: int = 500_000):
+    serie = _coluna_valores(n)
+    esperado = serie.apply(converter_para_float)
+    obtido = converter_para_float_serie(serie)
+    assert esperado.to_numpy().tobytes() == obtido.to_numpy().tobytes(), "resultado divergente"
+    t_apply = _medir(lambda: serie.apply(converter_para_float))
+    t_vet = _medir(lambda: converter_para_float_serie(serie))
+    print(f"Valor ({n} linhas): apply={t_apply:.3f}s vetorizado={t_vet:.3f}s ({t_apply / t_vet:.1f}x)")
+
+
+def _agregar_por_nota_referencia(df: pd.DataFrame) -> pd.DataFrame:
+    """Implementacao anterior (groupby com reducer Python), mantida so como referencia do benchmark."""
+    def first_non_empty(series: pd.Series):
+        for v in series:
+            if pd.notna(v) and str(v).strip() != "":
+                return v
+        return np.nan
+
+    grouped = df.groupby("Nota", as_index=False).agg(
+        Centavos=("Centavos", "sum"),
+        Data=("Data", "min"),
+        Codigo=("Codigo", first_non_empty),
+        Status_NFE=("Status_NFE", first_non_empty),
+    )
+    return grouped[["Codigo", "Nota", "Centavos", "Data", "Status_NFE"]]
+
+
+def _linhas_por_cfop(n: int, seed: int = 0) -> pd.DataFrame:
+    """Linhas preparadas com muita repeticao de nota (varios CFOPs por documento) e Status_NFE so em algumas linhas."""
+    rng = np.random.default_rng(seed)
+    status = rng.choice(np.array(["", " ", None, "A", "C", "I"], dtype=object), n)
+    return pd.DataFrame(
+        {
+            "Codigo": pd.Categorical([None] * n),
+            "Nota": rng.integers(1, max(2, n // 8), n),
+            "Centavos": rng.integers(1, 100_000, n),
+            "Data": pd.Timestamp("2025-11-01") + pd.to_timedelta(rng.integers(0, 30, n), unit="D"),
+            "Status_NFE": pd.Categorical(status),
+        }
+    )
+
+
+def bench_agregacao(n: int = 100_000):
+    df = _linhas_por_cfop(n)
+    esperado = _agregar_por_nota_referencia(df.astype({"Codigo": object, "Status_NFE": object}))
+    obtido = agregar_por_nota(df).astype({"Codigo": object, "Status_NFE": object})
+    pd.testing.assert_frame_equal(esperado, obtido, check_dtype=False)
+    t_ref = _medir(lambda: _agregar_por_nota_referencia(df.astype({"Codigo": object, "Status_NFE": object})))
+    t_novo = _medir(lambda: agregar_por_nota(df))
+    print(
+        f"Agregacao ({n} linhas, {len(obtido)} notas): first_non_empty={t_ref:.3f}s "
+        f"groupby.first={t_novo:.3f}s ({t_ref / t_novo:.1f}x)"
+    )
+
+
+def bench_esquema(n: int = 1_000_000):
+    """Memoria das notas preparadas: esquema anterior (texto/float/object) x COLUNAS_NOTAS (int64/centavos/categorias)."""
+    novo = _linhas_por_cfop(n)
+    anterior = pd.DataFrame(
+        {
+            "Nota": novo["Nota"].astype(str).astype(object),
+            "Valor": novo["Centavos"] / 100,
+            "Data": novo["Data"],
+            "Codigo": "",
+            "Status_NFE": novo["Status_NFE"].astype(object).fillna(""),
+            "Nota_num": novo["Nota"],
+        }
+    )
+    mb_ant = anterior.memory_usage(deep=True).sum() / 2**20
+    mb_novo = novo.memory_usage(deep=True).sum() / 2**20
+    print(f"Esquema ({n} linhas): texto/float={mb_ant:.1f}MB int/centavos/categorias={mb_novo:.1f}MB ({mb_ant / mb_novo:.1f}x)")
+
+
+def _lados_agregados(n: int, seed: int = 0):
+    """Dois lados ja agregados (notas unicas e ordenadas), ~80% das notas em comum."""
+    rng = np.random.default_rng(seed)
+    universo = np.sort(rng.choice(np.arange(1, 4 * n), size=int(n * 1.25), replace=False))
+    lados = []
+    for _ in range(2):
+        notas = np.sort(rng.choice(universo, size=n, replace=False))
+        lados.append(pd.DataFrame({"Nota": notas, "Centavos": rng.integers(1, 10_000_000, n)}))
+    return lados
+
+
+def _juntar_merge(dom: pd.DataFrame, emp: pd.DataFrame):
+    df = pd.merge(dom, emp, on="Nota", how="outer", suffixes=("_Dom", "_Emp"), indicator=True)
+    df = df.sort_values("Nota", ignore_index=True)
+    d = df["Centavos_Dom"].fillna(0).astype("int64").to_numpy()
+    e = df["Centavos_Emp"].fillna(0).astype("int64").to_numpy()
+    return df["Nota"].to_numpy(), (df["_merge"] != "right_only").to_numpy(), (df["_merge"] != "left_only").to_numpy(), d - e
+
+
+def _juntar_ordenado(dom: pd.DataFrame, emp: pd.DataFrame):
+    notas, pos_d, pos_e = juntar_por_nota(dom["Nota"].to_numpy(), emp["Nota"].to_numpy())
+    d = np.append(dom["Centavos"].to_numpy(), 0)[pos_d]
+    e = np.append(emp["Centavos"].to_numpy(), 0)[pos_e]
+    return notas, pos_d >= 0, pos_e >= 0, d - e
+
+
+def bench_juntar(tamanhos=(10_000, 100_000, 1_000_000)):
+    for n in tamanhos:
+        dom, emp = _lados_agregados(n)
+        for esperado, obtido in zip(_juntar_merge(dom, emp), _juntar_ordenado(dom, emp)):
+            assert np.array_equal(esperado, obtido), "resultado divergente"
+        t_merge = _medir(lambda: _juntar_merge(dom, emp))
+        t_novo = _medir(lambda: _juntar_ordenado(dom, emp))
+        print(f"Juntar ({n} notas por lado): pd.merge={t_merge:.4f}s juntar_por_nota={t_novo:.4f}s ({t_merge / t_novo:.1f}x)")
+
+
+def bench_escrita(n: int = 100_000):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "Codigo": "",
+            "Nota": np.arange(1, n + 1).astype(str),
+            "Valor_Dom": rng.integers(0, 1_000_000, n) / 100,
+            "Valor_Emp": rng.integers(0, 1_000_000, n) / 100,
+        }
+    )
+    df["Diferenca"] = df["Valor_Dom"] - df["Valor_Emp"]
+    df["Status"] = pd.Categorical(rng.choice(STATUS_CATEGORIAS, n), categories=STATUS_CATEGORIAS)
+    pasta = Path(tempfile.mkdtemp())
+
+    def to_excel():
+        with pd.ExcelWriter(pasta / "to_excel.xlsx", engine="xlsxwriter") as writer:
+            df.to_excel(writer, index=False, sheet_name="Conciliacao Completa")
+
+    def gravar():
+        with xlsxwriter.Workbook(str(pasta / "gravar.xlsx"), {"constant_memory": True}) as wb:
+            gravar_tabela(wb, "Conciliacao Completa", df, {}, wb.add_format({"bold": True}))
+
+    t_ref = _medir(to_excel, repeticoes=1)
+    t_novo = _medir(gravar, repeticoes=1)
+    pd.testing.assert_frame_equal(pd.read_excel(pasta / "to_excel.xlsx"), pd.read_excel(pasta / "gravar.xlsx"))
+    print(f"Escrita ({n} linhas): to_excel={t_ref:.3f}s gravar_tabela={t_novo:.3f}s ({t_ref / t_novo:.1f}x)")
+
+
+if __name__ == "__main__":
+    bench_valores()
+    bench_agregacao()
+    bench_esquema()
+    bench_juntar()
+    bench_escrita()
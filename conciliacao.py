@@ -1,16 +1,32 @@
 import os
 import re
-import sys
+import json
+import argparse
+import hashlib
+import functools
 import shutil
 import tempfile
+import contextlib
+import itertools
+import operator
+import multiprocessing
+import queue
 import subprocess
+import threading
+import time
+import zipfile
 import configparser
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from utils import resource_path
 from pathlib import Path
 from numbers import Integral
-from typing import Callable, Optional, List, Dict
+from typing import Callable, Iterator, Optional, List, Dict, Tuple
 
+import numpy as np
 import pandas as pd
+import xlsxwriter
+from pandas.api.types import union_categoricals
 
 # --- Config carregada do config.ini ---
 CFG_PATH = Path(resource_path("config.ini"))
@@ -19,6 +35,16 @@ CFG.optionxform = str  # preserva maiusculas/minusculas das chaves
 if CFG_PATH.exists():
     CFG.read(CFG_PATH, encoding="utf-8")
 
+
+def _cfg_num(secao: str, chave: str, fallback, tipo: type):
+    """Numero/sim-nao do ini (tipo float, int ou bool); valor invalido no ini fica com o fallback."""
+    leitor = {float: CFG.getfloat, int: CFG.getint, bool: CFG.getboolean}[tipo]
+    try:
+        return leitor(secao, chave, fallback=fallback)
+    except ValueError:
+        return fallback
+
+
 # Config padrao (sobrescrito pelo ini quando presente)
 MES_ANO_DEFAULT = CFG.get("GERAL", "MES_ANO", fallback="11-2025")
 DIR_SAIDA_RPA = CFG.get("GERAL", "ARQUIVOS_GLOBAIS", fallback=CFG.get("GERAL", "PASTA_BASE", fallback=r"V:\Fiscal\RPA"))
@@ -26,6 +52,22 @@ DIR_SAIDA_RPA = CFG.get("GERAL", "ARQUIVOS_GLOBAIS", fallback=CFG.get("GERAL", "
 # Bases de busca para as empresas (suporta uso de {ano} e {mes_ano})
 BASES_TEMPLATE = [v for _, v in CFG.items("caminhos_base")] if CFG.has_section("caminhos_base") else []
 
+# Diferenca maxima (em R$) entre Dominio e Empresa para considerar a nota OK
+TOLERANCIA = _cfg_num("PADROES", "TOLERANCIA", 0.05, float)
+
+# Segunda passada opcional: propoe pares entre notas So Dominio e So Empresa (valor dentro da TOLERANCIA, data na janela)
+SUGERIR_CORRESPONDENCIAS = _cfg_num("PADROES", "SUGERIR_CORRESPONDENCIAS", False, bool)
+JANELA_DIAS = max(0, _cfg_num("PADROES", "JANELA_DIAS", 3, int))
+# Candidatos examinados por nota e valor (muitas notas com o mesmo valor nao viram produto cartesiano)
+MAX_CANDIDATOS = 20
+
+# Status possiveis na conciliacao (coluna categorica)
+STATUS_CATEGORIAS = ["OK", "Divergencia Valor", "So Dominio", "So Empresa", "Inutilizada"]
+
+# Notas preparadas/agregadas: Nota = chave int64, Centavos = valor em centavos (int64), Codigo/Status_NFE categoricos
+# (vazio = NA) e Data datetime. Nota em texto e Valor em reais so na exportacao.
+COLUNAS_NOTAS = ["Codigo", "Nota", "Centavos", "Data", "Status_NFE"]
+
 # Estrutura de relatorios
 SUBPASTA_RELATORIO = CFG.get(
     "estrutura_relatorios", "subpasta_relatorio", fallback=r""
@@ -99,6 +141,146 @@ LIBREOFFICE_CANDIDATOS = [
     r"C:\Program Files\LibreOffice\program\scalc.exe",
 ]
 
+# Motores de leitura por extensao, na ordem de tentativa ([LEITURA] no ini).
+# "libreoffice" = conversao para XLSX + openpyxl (caminho antigo), usado so se os anteriores falharem.
+def _motores_cfg(chave: str, padrao: str) -> List[str]:
+    valor = CFG.get("LEITURA", chave, fallback=padrao)
+    return [m.strip().lower() for m in valor.split(",") if m.strip()]
+
+
+MOTORES_XLS = _motores_cfg("MOTORES_XLS", "calamine, xlrd, libreoffice")
+MOTORES_XLSX = _motores_cfg("MOTORES_XLSX", "calamine, openpyxl")
+
+# .xlsx a partir deste tamanho sao lidos em blocos (openpyxl read-only), com memoria constante (0 = nunca)
+STREAMING_ACIMA_MB = _cfg_num("LEITURA", "STREAMING_ACIMA_MB", 100.0, float)
+LINHAS_POR_BLOCO = max(1, _cfg_num("LEITURA", "LINHAS_POR_BLOCO", 50000, int))
+
+# Processos para ler/preparar os relatorios de uma empresa em paralelo (0 = numero de CPUs, 1 = serial)
+PROCESSOS_LEITURA = _cfg_num("EXECUCAO", "PROCESSOS_LEITURA", 0, int)
+
+# Empresas processadas ao mesmo tempo (--jobs na linha de comando) e limite de conversoes LibreOffice simultaneas
+EMPRESAS_SIMULTANEAS = _cfg_num("EXECUCAO", "EMPRESAS_SIMULTANEAS", 1, int)
+CONVERSOES_SIMULTANEAS = max(1, _cfg_num("EXECUCAO", "CONVERSOES_SIMULTANEAS", 1, int))
+
+# Staging local: copia os relatorios da rede para PASTA_STAGING (so o que mudou), processa la e publica o Excel no fim
+STAGING_LOCAL = _cfg_num("EXECUCAO", "STAGING_LOCAL", False, bool)
+STAGING_DIR = Path(
+    os.path.expandvars(CFG.get("EXECUCAO", "PASTA_STAGING", fallback="").strip())
+    or str(Path(os.environ.get("LOCALAPPDATA") or Path.home()) / "RPA-DROGARIA" / "staging")
+)
+
+# Metricas por etapa de cada empresa (uma linha JSON por execucao) em ARQUIVO_METRICAS
+METRICAS = _cfg_num("EXECUCAO", "METRICAS", True, bool)
+ARQUIVO_METRICAS = Path(
+    os.path.expandvars(CFG.get("EXECUCAO", "ARQUIVO_METRICAS", fallback="").strip())
+    or str(Path(os.environ.get("LOCALAPPDATA") or Path.home()) / "RPA-DROGARIA" / "metricas.jsonl")
+)
+
+# Conversoes LibreOffice: CONVERSOES_SIMULTANEAS perfis isolados (-env:UserInstallation), cada um usado por uma
+# conversao de cada vez. Fila entre processos com os perfis livres (passada aos workers pelo _inicializar_worker).
+PERFIS_LIBREOFFICE_DIR = Path(os.environ.get("LOCALAPPDATA") or Path.home()) / "RPA-DROGARIA" / "libreoffice"
+_FILA_PERFIS = None
+# Limite de uma chamada do soffice: TEMPO_CONVERSAO segundos + SEGUNDOS_POR_MB por MB convertido (perfil novo: o dobro).
+# Estourou: a instancia e encerrada, o perfil recriado e a chamada repetida uma vez.
+TEMPO_CONVERSAO = max(10.0, _cfg_num("EXECUCAO", "TEMPO_CONVERSAO", 60.0, float))
+SEGUNDOS_POR_MB = 15.0
+# Espera maxima por um perfil livre: um worker morto com o perfil reservado nao devolve o indice a fila,
+# e sem limite as conversoes seguintes ficariam paradas para sempre.
+ESPERA_PERFIL = 30 * TEMPO_CONVERSAO
+
+# Manifesto do cache de conversoes .xls -> XLSX/<stem>.xlsx (fica ao lado da pasta XLSX)
+CACHE_CONVERSAO_MANIFESTO = "XLSX_cache.json"
+
+# Manifesto das execucoes (entradas, config, versao e resumo de cada Conciliacao_*.xlsx), na pasta Conciliacao.
+# Execucao repetida sem mudanca em nada disso devolve o Excel ja gerado.
+MANIFESTO_EXECUCAO = "Conciliacao_cache.json"
+SECOES_MANIFESTO = ["PADROES", "LEITURA", "LAYOUT_DOMINIO", "LAYOUT_EMPRESA"]
+
+# Cache dos relatorios ja preparados (COLUNAS_NOTAS em Parquet), em disco local.
+# VERSAO_REGRAS_PARSER entra na chave (com as regras de layout): incrementar ao mudar preparar_dataframe/normalizacoes.
+VERSAO_REGRAS_PARSER = "3"
+CACHE_RELATORIOS_DIR = Path(
+    os.path.expandvars(CFG.get("CACHE", "PASTA_RELATORIOS", fallback="").strip())
+    or str(Path(os.environ.get("LOCALAPPDATA") or Path.home()) / "RPA-DROGARIA" / "cache_relatorios")
+)
+CACHE_RELATORIOS_MAX_MB = _cfg_num("CACHE", "TAMANHO_MAX_MB", 500.0, float)
+# Estado da ultima conciliacao de cada Excel (notas agregadas por relatorio + conciliacao por nota), para a proxima
+# execucao so ler os relatorios novos/alterados e recalcular as notas deles.
+ESTADO_CONCILIACAO_DIR = CACHE_RELATORIOS_DIR / "estado"
+
+# Layouts dos relatorios ([LAYOUT_DOMINIO] / [LAYOUT_EMPRESA] no ini). Regras com alternativas separadas por "|",
+# tentadas em ordem: numero = coluna fixa (A = 0), "=texto" = nome igual, "texto" = nome contem ("a & b" = contem os dois).
+LAYOUTS_PADRAO = {
+    "DOMINIO": {
+        "CABECALHO": "nota & valor",
+        "LINHAS_BUSCA": "20",
+        "LINHA_CABECALHO": "5",
+        "MIN_COLUNAS": "23",
+        "NOTA": "=nota | 4",
+        "VALOR": "valor cont | 20",
+        "DATA": "=data | 2",
+        "STATUS": "",
+        "CODIGO": "",
+    },
+    "EMPRESA": {
+        "CABECALHO": "n.nota & status nfe | n.nota & status | nota & status",
+        "LINHAS_BUSCA": "25",
+        "LINHA_CABECALHO": "5",
+        "MIN_COLUNAS": "18",
+        "NOTA": "n.nota | 12",
+        "VALOR": "total nota | total produtos | 17",
+        "DATA": "dt.emiss | 10",
+        "STATUS": "20 | status & nfe",
+        "CODIGO": "",
+    },
+}
+
+
+def _regras_coluna(texto: str) -> List[Tuple[str, object]]:
+    regras: List[Tuple[str, object]] = []
+    for alt in texto.split("|"):
+        alt = alt.strip().lower()
+        if not alt:
+            continue
+        if alt.isdigit():
+            regras.append(("indice", int(alt)))
+        elif alt.startswith("="):
+            regras.append(("igual", alt[1:].strip()))
+        else:
+            regras.append(("contem", [t.strip() for t in alt.split("&") if t.strip()]))
+    return regras
+
+
+def _compilar_layout(bruto: Dict[str, str]) -> Dict:
+    layout = {
+        "cabecalho": [r for tipo, r in _regras_coluna(bruto["CABECALHO"]) if tipo == "contem"],
+        "linhas_busca": int(bruto["LINHAS_BUSCA"]),
+        "linha_padrao": int(bruto["LINHA_CABECALHO"]),
+        "min_colunas": int(bruto["MIN_COLUNAS"]),
+        "colunas": {campo.lower(): _regras_coluna(bruto[campo]) for campo in ("NOTA", "VALOR", "DATA", "STATUS", "CODIGO")},
+    }
+    # Hash das regras: entra nas chaves do registro de layouts e do cache de relatorios.
+    layout["regras"] = hashlib.sha1(json.dumps(bruto, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return layout
+
+
+def _carregar_layouts() -> Dict[str, Dict]:
+    layouts = {}
+    for tipo, padrao in LAYOUTS_PADRAO.items():
+        bruto = {k: CFG.get(f"LAYOUT_{tipo}", k, fallback=v) for k, v in padrao.items()}
+        try:
+            layouts[tipo] = _compilar_layout(bruto)
+        except ValueError:
+            layouts[tipo] = _compilar_layout(padrao)
+    return layouts
+
+
+LAYOUTS = _carregar_layouts()
+
+# Registro dos layouts ja vistos (linha do cabecalho + nomes -> colunas), para nao detectar de novo a cada arquivo.
+REGISTRO_LAYOUTS = CACHE_RELATORIOS_DIR / "layouts.json"
+_PLANOS_LAYOUT: Optional[Dict[str, Dict]] = None
+
 LOG_FN: Optional[Callable[[str], None]] = None
 
 
@@ -117,6 +299,60 @@ def log(msg: str):
     print(msg)
 
 
+# Metricas por etapa da execucao de uma empresa: nome -> tempo (s), chamadas, linhas de entrada/saida e bytes.
+# Etapas aninhadas (ex.: conversao dentro da leitura) contam so o proprio tempo, sem o das etapas internas.
+ETAPAS = ["descoberta", "conversao", "leitura", "preparo", "agregacao", "juncao", "classificacao", "escrita"]
+_METRICAS: Dict[str, Dict[str, float]] = {}
+_PILHA_ETAPAS: List[List[float]] = []
+
+
+def registrar_etapa(nome: str, segundos: float, linhas_entrada: int = 0, linhas_saida: int = 0, num_bytes: int = 0):
+    m = _METRICAS.setdefault(nome, {"s": 0.0, "chamadas": 0, "linhas_entrada": 0, "linhas_saida": 0, "bytes": 0})
+    m["s"] += segundos
+    m["chamadas"] += 1
+    m["linhas_entrada"] += int(linhas_entrada)
+    m["linhas_saida"] += int(linhas_saida)
+    m["bytes"] += int(num_bytes)
+
+
+def somar_metricas(outras: Dict[str, Dict[str, float]]):
+    """Acrescenta metricas medidas em outro processo (leitura em paralelo) as deste."""
+    for nome, m in outras.items():
+        atual = _METRICAS.setdefault(nome, dict.fromkeys(m, 0))
+        for k, v in m.items():
+            atual[k] = atual.get(k, 0) + v
+
+
+@contextlib.contextmanager
+def etapa(nome: str, linhas_entrada: int = 0, num_bytes: int = 0):
+    """Mede o bloco como a etapa nome; o bloco pode preencher "linhas_saida" / "bytes" no dict recebido."""
+    contadores = {"linhas_entrada": linhas_entrada, "linhas_saida": 0, "bytes": num_bytes}
+    _PILHA_ETAPAS.append([time.perf_counter(), 0.0])
+    try:
+        yield contadores
+    finally:
+        inicio, internas = _PILHA_ETAPAS.pop()
+        duracao = time.perf_counter() - inicio
+        if _PILHA_ETAPAS:
+            _PILHA_ETAPAS[-1][1] += duracao
+        registrar_etapa(
+            nome, duracao - internas, contadores["linhas_entrada"], contadores["linhas_saida"], contadores["bytes"]
+        )
+
+
+def medir_etapa(nome: str, entrada: Callable[[tuple], int] = lambda args: 0 if args[0] is None else len(args[0])):
+    """Decorador: cada chamada da funcao conta como a etapa nome (linhas de entrada por entrada(args), saida = len do retorno)."""
+    def decorador(fn):
+        @functools.wraps(fn)
+        def medida(*args, **kwargs):
+            with etapa(nome, linhas_entrada=entrada(args) if args else 0) as contadores:
+                resultado = fn(*args, **kwargs)
+                contadores["linhas_saida"] = len(resultado) if resultado is not None else 0
+                return resultado
+        return medida
+    return decorador
+
+
 def converter_para_float(texto):
     if pd.isna(texto) or str(texto).strip() == "":
         return 0.0
@@ -140,6 +376,57 @@ def converter_para_float(texto):
         return 0.0
 
 
+def converter_para_float_serie(serie: pd.Series) -> pd.Series:
+    """
+    Versao vetorizada de converter_para_float para uma coluna inteira.
+    Mesmas regras (formato BR "1.234,56" e US "1,234.56", vazios -> 0.0) e mesmo resultado celula a celula.
+    """
+    if serie is None or len(serie) == 0:
+        return pd.Series([], index=getattr(serie, "index", None), dtype="float64")
+
+    if pd.api.types.is_numeric_dtype(serie.dtype) and not pd.api.types.is_bool_dtype(serie.dtype):
+        return serie.astype("float64").fillna(0.0)
+
+    out = np.zeros(len(serie), dtype="float64")
+    valores = serie.to_numpy(dtype=object)
+    eh_texto = np.array([type(v) is str for v in valores], dtype=bool)
+
+    # Celulas numericas (int/float) entram direto; vazios ficam 0.0; tipos raros (bool, data) usam o conversor por celula.
+    if not eh_texto.all():
+        outros = pd.Series(valores[~eh_texto], dtype=object)
+        tipo = pd.api.types.infer_dtype(outros, skipna=True)
+        if tipo in ("integer", "floating", "mixed-integer-float", "empty"):
+            out[~eh_texto] = pd.to_numeric(outros, errors="coerce").fillna(0.0).to_numpy(dtype="float64")
+        else:
+            out[~eh_texto] = outros.map(converter_para_float).to_numpy(dtype="float64")
+
+    # Textos: relatorios repetem muito os mesmos valores, entao o parse roda so sobre os distintos.
+    if eh_texto.any():
+        codigos, distintos = pd.factorize(valores[eh_texto])
+        limpos = pd.Series(distintos, dtype=object).str.replace(r"[^\d.,-]", "", regex=True)
+        t = np.asarray(limpos.to_numpy(dtype=object), dtype=str)
+        pos_virg = np.char.find(t, ",")
+        pos_pont = np.char.find(t, ".")
+        mask_br = (pos_pont >= 0) & (pos_virg > pos_pont)  # 1.234,56
+        mask_us = (pos_virg >= 0) & (pos_pont > pos_virg)  # 1,234.56
+        t = np.where(mask_br, np.char.replace(t, ".", ""), t)
+        t = np.where(mask_us, np.char.replace(t, ",", ""), np.char.replace(t, ",", "."))
+        # So converte o que float() aceitaria; o resto (ex.: "1.2.3", "-", "5-") vira 0.0 como no conversor original.
+        n_pont = np.char.count(t, ".")
+        n_menos = np.char.count(t, "-")
+        validos = (
+            (n_pont <= 1)
+            & ((n_menos == 0) | ((n_menos == 1) & np.char.startswith(t, "-")))
+            & (np.char.str_len(t) > n_pont + n_menos)
+        )
+        vals_txt = np.zeros(len(t), dtype="float64")
+        if validos.any():
+            vals_txt[validos] = t[validos].astype(object).astype("float64")
+        out[eh_texto] = vals_txt[codigos]
+
+    return pd.Series(out, index=serie.index, dtype="float64")
+
+
 def normalizar_nota(nota):
     if pd.isna(nota):
         return "S/N"
@@ -155,6 +442,86 @@ def normalizar_nota(nota):
         return str(nota).strip()
 
 
+def normalizar_notas_serie(serie: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    """
+    Versao vetorizada de normalizar_nota para uma coluna inteira.
+    Retorna (Nota em texto, identica a normalizar_nota celula a celula; chave Int64 da nota, <NA> quando nao numerica).
+    """
+    n = len(serie)
+    valores = serie.to_numpy(dtype=object)
+    notas = np.full(n, "S/N", dtype=object)
+    chaves = np.zeros(n, dtype="int64")
+    tem_chave = np.zeros(n, dtype=bool)
+    fallback = np.zeros(n, dtype=bool)
+    if n == 0:
+        return pd.Series(notas, index=serie.index), pd.Series(chaves, index=serie.index, dtype="Int64")
+
+    codigos_tipo = {str: 1, float: 2, int: 3}
+    tipos = np.array([codigos_tipo.get(type(v), 0) for v in valores], dtype="int8")
+    vazio = pd.isna(valores)
+    eh_texto = tipos == 1
+    eh_float = (tipos == 2) & ~vazio
+    eh_int = tipos == 3
+    fallback |= ~(vazio | eh_texto | eh_float | eh_int)
+
+    # Numeros: str(v) perde o sinal e float() devolve |v|. Floats em notacao cientifica (str(1e16) == "1e+16")
+    # e inteiros fora do int64 ficam com o conversor por celula.
+    for mask, limite_ok in ((eh_float, True), (eh_int, False)):
+        if not mask.any():
+            continue
+        absolutos = np.abs(valores[mask].astype("float64"))
+        if limite_ok:
+            ok = (absolutos == 0) | ((absolutos >= 1e-4) & (absolutos < 1e16))
+        else:
+            ok = absolutos < 2.0**63
+        idx = np.flatnonzero(mask)
+        fallback[idx[~ok]] = True
+        idx, absolutos = idx[ok], absolutos[ok]
+        positivos = absolutos > 0
+        chaves[idx[positivos]] = absolutos[positivos].astype("int64")
+        tem_chave[idx[positivos]] = True
+
+    # Textos: o parse roda uma vez por valor distinto.
+    if eh_texto.any():
+        idx_txt = np.flatnonzero(eh_texto)
+        codigos, distintos = pd.factorize(valores[eh_texto])
+        limpos = pd.Series(distintos, dtype=object).str.replace(r"[^\d.]", "", regex=True)
+        t = np.asarray(limpos.to_numpy(dtype=object), dtype=str)
+        n_pont = np.char.count(t, ".")
+        n_dig = np.char.str_len(t) - n_pont
+        vazio_d = np.char.str_len(t) == 0
+        validos = (n_pont <= 1) & (n_dig >= 1)
+        vals = np.zeros(len(t), dtype="float64")
+        if validos.any():
+            vals[validos] = t[validos].astype(object).astype("float64")
+        fora = validos & ~(vals < 2.0**63)
+        validos &= ~fora
+        positivos = validos & (vals > 0)
+        chaves_d = np.zeros(len(t), dtype="int64")
+        chaves_d[positivos] = vals[positivos].astype("int64")
+
+        fallback[idx_txt[(~validos & ~vazio_d)[codigos] | fora[codigos]]] = True
+        sel = positivos[codigos]
+        chaves[idx_txt[sel]] = chaves_d[codigos][sel]
+        tem_chave[idx_txt[sel]] = True
+
+    if tem_chave.any():
+        codigos, distintas = pd.factorize(chaves[tem_chave])
+        notas[tem_chave] = distintas.astype(str).astype(object)[codigos]
+    if fallback.any():
+        notas_fb = pd.Series(valores[fallback], dtype=object).map(normalizar_nota)
+        notas[fallback] = notas_fb.to_numpy(dtype=object)
+        idx_fb = np.flatnonzero(fallback)
+        for i, nota in zip(idx_fb, notas_fb):
+            if nota.isascii() and nota.isdigit() and len(nota) <= 18:
+                chaves[i] = int(nota)
+                tem_chave[i] = True
+
+    chave_serie = pd.Series(chaves, index=serie.index, dtype="Int64")
+    chave_serie[~tem_chave] = pd.NA
+    return pd.Series(notas, index=serie.index, dtype=object), chave_serie
+
+
 def preencher_mesclados(df: pd.DataFrame) -> pd.DataFrame:
     if df is None or df.empty:
         return df
@@ -165,16 +532,78 @@ def preencher_mesclados(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def parse_data(col) -> pd.Series:
+def detectar_linhas_total(df: pd.DataFrame) -> pd.Series:
+    """
+    Marca as linhas com "total" em alguma celula (subtotais/rodape).
+    So colunas de texto podem conter a palavra; em cada uma, testa apenas as celulas preenchidas e cada valor distinto uma vez.
+    """
+    if df is None or df.empty:
+        return pd.Series(False, index=getattr(df, "index", None), dtype=bool)
+    mask = np.zeros(len(df), dtype=bool)
+    for i, dt in enumerate(df.dtypes):
+        if not pd.api.types.is_string_dtype(dt):
+            continue
+        col = df.iloc[:, i]
+        preenchidas = col.notna().to_numpy()
+        if not preenchidas.any():
+            continue
+        codigos, distintos = pd.factorize(col.to_numpy(dtype=object)[preenchidas])
+        # A coluna pode ser object so com numeros (o texto do cabecalho ja foi cortado): testa so os textos.
+        tem_total = np.array([isinstance(v, str) and "total" in v.lower() for v in distintos], dtype=bool)
+        if tem_total.any():
+            mask[preenchidas] |= tem_total[codigos]
+    return pd.Series(mask, index=df.index, dtype=bool)
+
+
+# Formatos tentados na ordem para a coluna Data (o primeiro que reconhece mais da metade dos valores vale)
+FORMATOS_DATA: Dict[str, Callable[[pd.Series], pd.Series]] = {
+    "dd/mm/aaaa": lambda s: pd.to_datetime(s, errors="coerce", format="%d/%m/%Y"),
+    "dia_primeiro": lambda s: pd.to_datetime(s, errors="coerce", dayfirst=True),
+    "serial_excel": lambda s: pd.to_datetime(pd.to_numeric(s, errors="coerce"), unit="D", origin="1899-12-30"),
+}
+AMOSTRA_DATAS = 200
+# Formato ja inferido por layout (chave do plano de extracao)
+_FORMATOS_LAYOUT: Dict[str, str] = {}
+
+
+def _mascarar_cabecalho_data(col) -> pd.Series:
     s = col.copy()
-    mask_header = s.astype(str).str.contains("dt", case=False, na=False) | s.astype(str).str.contains("emiss", case=False, na=False)
-    s = s.mask(mask_header)
-    ser = pd.to_datetime(s, errors="coerce", format="%d/%m/%Y")
-    if ser.isna().mean() > 0.5:
-        ser = pd.to_datetime(s, errors="coerce", dayfirst=True)
-    if ser.isna().mean() > 0.5:
-        ser = pd.to_datetime(s, errors="coerce", unit="d", origin="1899-12-30")
-    return ser
+    texto = s.astype(str)
+    mask_header = texto.str.contains("dt", case=False, na=False) | texto.str.contains("emiss", case=False, na=False)
+    return s.mask(mask_header)
+
+
+def inferir_formato_data(col: pd.Series) -> str:
+    """Formato da coluna Data decidido numa amostra espalhada dos valores preenchidos (no maximo AMOSTRA_DATAS)."""
+    preenchidos = col[col.notna()]
+    if len(preenchidos) > AMOSTRA_DATAS:
+        preenchidos = preenchidos.iloc[np.linspace(0, len(preenchidos) - 1, AMOSTRA_DATAS).astype(int)]
+    if preenchidos.empty:
+        return next(iter(FORMATOS_DATA))
+    for nome, converter in FORMATOS_DATA.items():
+        if converter(preenchidos).isna().mean() <= 0.5:
+            return nome
+    return "serial_excel"
+
+
+def parse_data(col, layout: Optional[str] = None) -> pd.Series:
+    """
+    Converte a coluna Data num unico pd.to_datetime, com o formato inferido de uma amostra.
+    Com layout, o formato fica guardado e os proximos arquivos/blocos do mesmo layout nao repetem a inferencia
+    (so se ele deixar de reconhecer mais da metade dos valores).
+    """
+    s = _mascarar_cabecalho_data(col)
+    formato = _FORMATOS_LAYOUT.get(layout) if layout else None
+    if formato is not None:
+        ser = FORMATOS_DATA[formato](s)
+        if ser[s.notna()].isna().mean() <= 0.5:
+            return ser
+    novo = inferir_formato_data(s)
+    if layout:
+        _FORMATOS_LAYOUT[layout] = novo
+    if novo == formato:
+        return ser
+    return FORMATOS_DATA[novo](s)
 
 
 def encontrar_libreoffice() -> Optional[Path]:
@@ -185,213 +614,1005 @@ def encontrar_libreoffice() -> Optional[Path]:
     return None
 
 
-def converter_para_xlsx(caminho_arquivo: Path) -> Optional[Path]:
-    if caminho_arquivo.suffix.lower() != ".xls":
-        return caminho_arquivo
+def _gravar_atomico(destino: Path, dados: bytes):
+    """
+    Grava dados num temporario ao lado de destino (pid no nome) e troca por os.replace: quem le ve o arquivo
+    anterior ou o novo, nunca pela metade. Em erro o temporario e apagado e a excecao segue para quem chamou.
+    """
+    tmp = destino.with_name(f"{destino.name}.{os.getpid()}.tmp")
+    try:
+        tmp.write_bytes(dados)
+        os.replace(tmp, destino)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            tmp.unlink()
+        raise
+
+
+def _hash_arquivo(caminho: Path) -> str:
+    h = hashlib.sha256()
+    with open(caminho, "rb") as fh:
+        for bloco in iter(lambda: fh.read(1024 * 1024), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def _ler_manifesto_conversao(xlsx_dir: Path) -> Dict[str, Dict]:
+    manifesto = xlsx_dir.parent / CACHE_CONVERSAO_MANIFESTO
+    if not manifesto.exists():
+        return {}
+    try:
+        dados = json.loads(manifesto.read_text(encoding="utf-8"))
+        return dados if isinstance(dados, dict) else {}
+    except Exception:
+        return {}
+
+
+def _gravar_manifesto_conversao(xlsx_dir: Path, dados: Dict[str, Dict]):
+    manifesto = xlsx_dir.parent / CACHE_CONVERSAO_MANIFESTO
+    try:
+        _gravar_atomico(manifesto, json.dumps(dados, indent=2, ensure_ascii=False).encode("utf-8"))
+    except Exception as exc:
+        log(f"[AVISO] Falha ao gravar cache de conversao: {exc}")
+
+
+def _registrar_conversao(caminho_arquivo: Path, destino: Path, sha256: Optional[str]):
+    st = caminho_arquivo.stat()
+    # Rele o manifesto antes de gravar: outra conversao da mesma pasta pode ter registrado entradas.
+    dados = _ler_manifesto_conversao(destino.parent)
+    dados[caminho_arquivo.name] = {
+        "tamanho": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "sha256": sha256,
+        "destino": destino.name,
+    }
+    _gravar_manifesto_conversao(destino.parent, dados)
+
+
+def conversoes_orfas(xlsx_dir: Path, existentes: Optional[set] = None) -> Dict[str, str]:
+    """
+    Entradas do cache de conversao cujo .xls de origem nao existe mais: nome do .xls -> nome do XLSX convertido.
+    existentes: nomes (minusculos) dos arquivos da pasta, quando ja listados; senao testa cada um no disco.
+    """
+    dados = _ler_manifesto_conversao(xlsx_dir)
+    if existentes is not None:
+        orfas = [nome for nome in dados if nome.lower() not in existentes]
+    else:
+        orfas = [nome for nome in dados if not (xlsx_dir.parent / nome).exists()]
+    return {nome: Path(str(dados[nome].get("destino", ""))).name for nome in orfas}
+
+
+def limpar_cache_conversoes(xlsx_dir: Path, existentes: Optional[set] = None) -> int:
+    """Remove do cache (manifesto + XLSX convertido) as entradas de conversoes_orfas."""
+    orfas = conversoes_orfas(xlsx_dir, existentes)
+    if not orfas:
+        return 0
+    dados = _ler_manifesto_conversao(xlsx_dir)
+    for nome, arquivo in orfas.items():
+        destino = xlsx_dir / arquivo
+        if destino.is_file() and destino.suffix.lower() == ".xlsx":
+            try:
+                destino.unlink()
+            except OSError as exc:
+                log(f"[AVISO] Nao foi possivel remover conversao orfa {destino.name}: {exc}")
+        dados.pop(nome, None)
+    _gravar_manifesto_conversao(xlsx_dir, dados)
+    log(f"Cache de conversao: {len(orfas)} entrada(s) orfa(s) removida(s).")
+    return len(orfas)
+
+
+def _conversao_em_cache(caminho_arquivo: Path, destino: Path) -> Tuple[bool, Optional[str]]:
+    """
+    Verifica se XLSX/<stem>.xlsx ainda corresponde ao .xls. Tamanho+mtime iguais bastam; com mtime
+    diferente e mesmo tamanho, confirma pelo hash do conteudo. Retorna (valido, sha256 se foi calculado agora).
+    """
+    if not destino.is_file():
+        return False, None
+    entrada = _ler_manifesto_conversao(destino.parent).get(caminho_arquivo.name)
+    st = caminho_arquivo.stat()
+    if not entrada:
+        # Conversao feita antes do cache existir: vale se for mais nova que o .xls (passa a ser registrada).
+        if destino.stat().st_mtime_ns >= st.st_mtime_ns:
+            return True, _hash_arquivo(caminho_arquivo)
+        return False, None
+    if entrada.get("tamanho") != st.st_size:
+        return False, None
+    if entrada.get("mtime_ns") == st.st_mtime_ns:
+        return True, None
+    sha256 = _hash_arquivo(caminho_arquivo)
+    return sha256 == entrada.get("sha256"), sha256
+
+
+def _conversao_existente(caminho_arquivo: Path, destino: Path) -> Tuple[bool, Optional[str]]:
+    """Conversao ainda valida de caminho_arquivo em destino (ou do mesmo conteudo sob outro nome). Retorna (pronta, sha256)."""
+    sha256 = None
+    try:
+        valido, sha256 = _conversao_em_cache(caminho_arquivo, destino)
+        if valido:
+            log(f"Conversao em cache: {destino.name}")
+            if sha256:
+                _registrar_conversao(caminho_arquivo, destino, sha256)
+            return True, sha256
+        sha256 = sha256 or _hash_arquivo(caminho_arquivo)
+        # Mesmo conteudo ja convertido sob outro nome (ex.: arquivo renomeado/copiado).
+        for nome, entrada in _ler_manifesto_conversao(destino.parent).items():
+            outro = destino.parent / Path(str(entrada.get("destino", ""))).name
+            if nome != caminho_arquivo.name and entrada.get("sha256") == sha256 and outro.is_file() and outro != destino:
+                shutil.copy2(outro, destino)
+                log(f"Conversao em cache (mesmo conteudo de {nome}): {destino.name}")
+                _registrar_conversao(caminho_arquivo, destino, sha256)
+                return True, sha256
+    except Exception as exc:
+        log(f"[AVISO] Cache de conversao indisponivel: {exc}")
+    return False, sha256
+
+
+def _fila_perfis():
+    """Fila dos perfis LibreOffice livres (0 .. CONVERSOES_SIMULTANEAS-1), criada no primeiro uso do processo principal."""
+    global _FILA_PERFIS
+    if _FILA_PERFIS is None:
+        _FILA_PERFIS = multiprocessing.Queue()
+        for i in range(CONVERSOES_SIMULTANEAS):
+            _FILA_PERFIS.put(i)
+    return _FILA_PERFIS
+
+
+def _descartar_fila_perfis():
+    """Pool quebrado (worker morto) pode ter levado um perfil reservado: a proxima reserva cria a fila de novo, completa."""
+    global _FILA_PERFIS
+    _FILA_PERFIS = None
+
+
+@contextlib.contextmanager
+def _perfil_libreoffice():
+    """Reserva um perfil isolado (pasta propria de UserInstallation) enquanto o soffice roda; None se nenhum liberou a tempo."""
+    fila = _fila_perfis()
+    try:
+        indice = fila.get(timeout=ESPERA_PERFIL)
+    except queue.Empty:
+        log(f"[ERRO CONVERSAO] Nenhum perfil LibreOffice livre em {ESPERA_PERFIL:.0f}s")
+        yield None
+        return
+    try:
+        yield PERFIS_LIBREOFFICE_DIR / f"perfil_{indice}"
+    finally:
+        fila.put(indice)
+
+
+def _encerrar_processo(proc: subprocess.Popen):
+    """Mata o soffice e os processos filhos (soffice.bin)."""
+    with contextlib.suppress(Exception):
+        if os.name == "nt":
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)], capture_output=True, timeout=30)
+        else:
+            os.killpg(proc.pid, 9)
+    with contextlib.suppress(Exception):
+        proc.kill()
+        proc.wait(timeout=10)
+
+
+def _rodar_soffice(libre: Path, arquivos: List[Path], outdir: Path) -> bool:
+    """
+    Converte os arquivos para XLSX em outdir numa unica chamada do soffice, com um perfil isolado.
+    Health check: perfil com .lock de instancia morta e limpo antes; chamada que passa do limite (travada) e encerrada,
+    o perfil recriado do zero e a chamada repetida uma vez. Retorna False se nao terminou com sucesso.
+    """
+    mb = sum(f.stat().st_size for f in arquivos) / 2**20
+    with _perfil_libreoffice() as perfil:
+        if perfil is None:
+            return False
+        for tentativa in range(2):
+            # O perfil e exclusivo desta chamada: .lock que sobrou e de uma instancia que morreu.
+            with contextlib.suppress(OSError):
+                (perfil / ".lock").unlink()
+            limite = (TEMPO_CONVERSAO + SEGUNDOS_POR_MB * mb) * (1 if perfil.is_dir() else 2)
+            cmd = [
+                str(libre),
+                f"-env:UserInstallation={perfil.as_uri()}",
+                "--headless",
+                "--norestore",
+                "--convert-to",
+                "xlsx",
+                "--outdir",
+                str(outdir),
+                *map(str, arquivos),
+            ]
+            sessao = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP} if os.name == "nt" else {"start_new_session": True}
+            try:
+                proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, **sessao)
+            except OSError as exc:
+                log(f"[ERRO CONVERSAO] {exc}")
+                return False
+            try:
+                saida, erro = proc.communicate(timeout=limite)
+            except subprocess.TimeoutExpired:
+                _encerrar_processo(proc)
+                log(f"[AVISO] LibreOffice travado ({limite:.0f}s sem terminar), recriando o perfil {perfil.name}")
+                shutil.rmtree(perfil, ignore_errors=True)
+                continue
+            if proc.returncode != 0:
+                log(f"[ERRO CONVERSAO] {(erro or '').strip() or (saida or '').strip()}")
+            return proc.returncode == 0
+    return False
+
+
+def converter_lote(arquivos: List[Path]) -> Dict[Path, Optional[Path]]:
+    """
+    Converte varios .xls para XLSX/<stem>.xlsx (pasta de cada um), reaproveitando as conversoes em cache.
+    Os pendentes vao em poucas chamadas do soffice (uma partida a frio por lote, nao por arquivo), repartidos entre
+    os CONVERSOES_SIMULTANEAS perfis, que rodam ao mesmo tempo. Retorna arquivo -> XLSX (None se falhou);
+    arquivo que nao e .xls volta ele mesmo.
+    """
+    resultado: Dict[Path, Optional[Path]] = {}
+    pendentes: List[Tuple[Path, Path, Optional[str]]] = []
+    for f in arquivos:
+        if f.suffix.lower() != ".xls":
+            resultado[f] = f
+            continue
+        destino = f.parent / "XLSX" / f"{f.stem}.xlsx"
+        destino.parent.mkdir(exist_ok=True)
+        pronta, sha256 = _conversao_existente(f, destino)
+        if pronta:
+            resultado[f] = destino
+        else:
+            pendentes.append((f, destino, sha256))
+    if not pendentes:
+        return resultado
 
     libre = encontrar_libreoffice()
     if not libre:
         log("[ERRO] LibreOffice nao encontrado (soffice/scalc).")
+        resultado.update({f: None for f, _, _ in pendentes})
+        return resultado
+
+    # Um lote por perfil; o soffice grava <stem>.xlsx no outdir, entao o mesmo stem nao pode repetir num lote.
+    lotes: List[List[Tuple[Path, Path, Optional[str]]]] = [[] for _ in range(min(CONVERSOES_SIMULTANEAS, len(pendentes)))]
+    for item in pendentes:
+        livres = [lote for lote in lotes if all(item[0].stem.lower() != f.stem.lower() for f, _, _ in lote)]
+        if not livres:
+            livres = [[]]
+            lotes.append(livres[0])
+        min(livres, key=len).append(item)
+
+    trava_manifesto = threading.Lock()  # lotes da mesma pasta gravam o mesmo XLSX_cache.json
+
+    def converter(lote: List[Tuple[Path, Path, Optional[str]]]) -> List[Tuple[Path, Optional[Path]]]:
+        tmpdir = Path(tempfile.mkdtemp(prefix="conv_rpa_"))
+        try:
+            _rodar_soffice(libre, [f for f, _, _ in lote], tmpdir)
+            convertidos = []
+            for f, destino, sha256 in lote:
+                gerado = tmpdir / f"{f.stem}.xlsx"
+                if not gerado.is_file():
+                    log(f"[ERRO CONVERSAO] Nenhum .xlsx gerado para {f.name}.")
+                    convertidos.append((f, None))
+                    continue
+                try:
+                    shutil.move(str(gerado), destino)
+                except Exception as exc:
+                    log(f"[ERRO CONVERSAO] Falha ao mover arquivo convertido: {exc}")
+                    convertidos.append((f, None))
+                    continue
+                try:
+                    with trava_manifesto:
+                        _registrar_conversao(f, destino, sha256 or _hash_arquivo(f))
+                except Exception as exc:
+                    log(f"[AVISO] Falha ao registrar conversao no cache: {exc}")
+                convertidos.append((f, destino))
+            return convertidos
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    for f, _, _ in pendentes:
+        log(f"Convertendo {f.name} para XLSX...")
+    # O soffice roda fora do Python: threads bastam para manter os perfis ocupados ao mesmo tempo.
+    tamanho = sum(f.stat().st_size for f, _, _ in pendentes)
+    with etapa("conversao", linhas_entrada=len(pendentes), num_bytes=tamanho) as contadores:
+        with ThreadPoolExecutor(max_workers=len(lotes)) as pool:
+            for convertidos in pool.map(converter, [lote for lote in lotes if lote]):
+                resultado.update(convertidos)
+        contadores["linhas_saida"] = sum(1 for f, _, _ in pendentes if resultado.get(f))
+    return resultado
+
+
+def converter_para_xlsx(caminho_arquivo: Path) -> Optional[Path]:
+    return converter_lote([caminho_arquivo])[caminho_arquivo]
+
+
+def _leitor_pandas(engine: str) -> Callable[[Path], pd.DataFrame]:
+    def ler(caminho_arquivo: Path) -> pd.DataFrame:
+        return pd.read_excel(caminho_arquivo, header=None, engine=engine)
+    return ler
+
+
+def _ler_via_libreoffice(caminho_arquivo: Path) -> pd.DataFrame:
+    caminho_para_ler = converter_para_xlsx(caminho_arquivo)
+    if not caminho_para_ler:
+        raise RuntimeError("Conversao/obtencao do arquivo falhou.")
+    return pd.read_excel(caminho_para_ler, header=None, engine="openpyxl")
+
+
+# nome -> (leitor, extensoes suportadas). Leitores levantam excecao em caso de falha (ImportError se faltar a lib).
+MOTORES_LEITURA: Dict[str, Tuple[Callable[[Path], pd.DataFrame], Tuple[str, ...]]] = {
+    "calamine": (_leitor_pandas("calamine"), (".xls", ".xlsx")),
+    "xlrd": (_leitor_pandas("xlrd"), (".xls",)),
+    "openpyxl": (_leitor_pandas("openpyxl"), (".xlsx",)),
+    "libreoffice": (_ler_via_libreoffice, (".xls", ".xlsx")),
+}
+
+
+def _linhas_calamine(caminho_arquivo: Path) -> Iterator[list]:
+    from python_calamine import CalamineWorkbook
+
+    wb = CalamineWorkbook.from_path(str(caminho_arquivo))
+    try:
+        aba = wb.get_sheet_by_index(0)
+        # iter_rows comeca na primeira coluna usada; completa a esquerda para manter os indices do pd.read_excel.
+        margem = [""] * (aba.start[1] if aba.start else 0)
+        for linha in aba.iter_rows():
+            yield margem + linha
+    finally:
+        wb.close()
+
+
+def _linhas_openpyxl(caminho_arquivo: Path) -> Iterator[tuple]:
+    from openpyxl import load_workbook
+
+    wb = load_workbook(caminho_arquivo, read_only=True, data_only=True)
+    try:
+        yield from wb.worksheets[0].iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+# Motores que entregam a planilha linha a linha (leitura projetada); os demais so leem a planilha inteira.
+LINHAS_MOTORES: Dict[str, Tuple[Callable[[Path], Iterator], Tuple[str, ...]]] = {
+    "calamine": (_linhas_calamine, (".xls", ".xlsx")),
+    "openpyxl": (_linhas_openpyxl, (".xlsx",)),
+}
+
+# Textos que o pd.read_excel le como vazio (na_values padrao do pandas).
+VALORES_VAZIOS = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+]
+
+
+def _ler_com_motores(caminho_arquivo: Path, motores: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+    sufixo = caminho_arquivo.suffix.lower()
+    if motores is None:
+        motores = MOTORES_XLS if sufixo == ".xls" else MOTORES_XLSX
+    for nome in motores:
+        motor = MOTORES_LEITURA.get(nome)
+        if motor is None:
+            log(f"[AVISO] Motor de leitura desconhecido no config.ini: {nome}")
+            continue
+        leitor, extensoes = motor
+        if sufixo not in extensoes:
+            continue
+        try:
+            df = leitor(caminho_arquivo)
+        except ImportError as exc:
+            log(f"[AVISO] Motor {nome} indisponivel: {exc}")
+            continue
+        except Exception as exc:
+            log(f"[AVISO] Motor {nome} falhou: {exc}")
+            continue
+        return preencher_mesclados(df)
+    log("[ERRO] Nenhum motor de leitura conseguiu abrir o arquivo.")
+    return None
+
+
+def ler_arquivo(caminho_arquivo: Path) -> Optional[pd.DataFrame]:
+    log(f"Lendo arquivo: {caminho_arquivo.name}")
+    return _ler_com_motores(caminho_arquivo)
+
+
+def _recortar_linhas(linhas: Iterator, tipo_origem: str) -> pd.DataFrame:
+    """
+    Leitura projetada: acha o cabecalho nas 30 primeiras linhas e so entao materializa as colunas usadas
+    das linhas abaixo dele, ja no formato do pd.read_excel. Linhas de total saem antes do recorte, testando a linha
+    inteira (o rotulo pode estar em qualquer coluna, como em detectar_linhas_total).
+    """
+    vazio = notas_vazias()
+    topo = list(itertools.islice(linhas, 30))
+    if len(topo) <= 6:
+        log("[ERRO] Planilha sem linhas suficientes para cabecalho")
+        return vazio
+    df_topo = pd.DataFrame(topo)
+    df_topo = df_topo.mask(df_topo.isin(VALORES_VAZIOS))
+    plano = plano_extracao(df_topo, tipo_origem)
+    if plano is None:
+        return vazio
+    colunas, header_idx = plano["colunas"], plano["cabecalho"]
+
+    usecols = sorted({p for p in colunas.values() if p is not None})
+    largura = usecols[-1] + 1
+    pegar = operator.itemgetter(*usecols)
+    recorte = []
+    for linha in itertools.chain(topo[header_idx + 1 :], linhas):
+        # Uma juncao por linha em vez de um teste por celula; "\n" nao deixa "total" se formar entre duas celulas.
+        if "total" in "\n".join([v for v in linha if isinstance(v, str)]).lower():
+            continue
+        if len(linha) < largura:
+            linha = tuple(linha) + (None,) * (largura - len(linha))
+        recorte.append(pegar(linha))
+    if not recorte:
+        return vazio
+
+    dados = {}
+    for j, valores in enumerate(zip(*recorte)):
+        col = pd.Series(valores, dtype=object)
+        dados[j] = col.mask(col.isin(VALORES_VAZIOS)).infer_objects()
+    # Colunas do recorte na ordem de usecols: traduz as posicoes originais para as do recorte.
+    colunas = {k: (None if p is None else usecols.index(p)) for k, p in colunas.items()}
+    return extrair_notas(pd.DataFrame(dados), colunas, layout=_chave_plano(plano))
+
+
+def ler_relatorio_projetado(caminho_arquivo: Path, tipo_origem: str) -> Optional[pd.DataFrame]:
+    """
+    ler_arquivo + preparar_dataframe materializando so as colunas usadas (Nota, Valor, Data, Status NFe).
+    Usa o primeiro motor do config.ini que le linha a linha (calamine, openpyxl); se nenhum servir,
+    le a planilha inteira com os motores restantes (xlrd, libreoffice). None se nenhum motor abrir o arquivo.
+    """
+    log(f"Lendo arquivo: {caminho_arquivo.name}")
+    sufixo = caminho_arquivo.suffix.lower()
+    motores = MOTORES_XLS if sufixo == ".xls" else MOTORES_XLSX
+    for nome in motores:
+        fonte = LINHAS_MOTORES.get(nome)
+        if fonte is None or sufixo not in fonte[1]:
+            continue
+        try:
+            return _recortar_linhas(fonte[0](caminho_arquivo), tipo_origem)
+        except ImportError as exc:
+            log(f"[AVISO] Motor {nome} indisponivel: {exc}")
+        except Exception as exc:
+            log(f"[AVISO] Motor {nome} falhou: {exc}")
+    restantes = [m for m in motores if m not in LINHAS_MOTORES]
+    df_raw = _ler_com_motores(caminho_arquivo, restantes)
+    if df_raw is None:
         return None
+    return preparar_dataframe(df_raw, tipo_origem)
 
-    xlsx_dir = caminho_arquivo.parent / "XLSX"
-    xlsx_dir.mkdir(exist_ok=True)
-    destino = xlsx_dir / f"{caminho_arquivo.stem}.xlsx"
-
-    tmpdir = Path(tempfile.mkdtemp(prefix="conv_rpa_"))
-    cmd = [
-        str(libre),
-        "--headless",
-        "--convert-to",
-        "xlsx",
-        "--outdir",
-        str(tmpdir),
-        str(caminho_arquivo),
-    ]
-    log(f"Convertendo {caminho_arquivo.name} para XLSX...")
+
+def _chave_cache_relatorio(caminho_arquivo: Path, tipo_origem: str) -> str:
+    st = caminho_arquivo.stat()
+    base = [str(caminho_arquivo.resolve()), st.st_size, st.st_mtime_ns, tipo_origem, VERSAO_REGRAS_PARSER, _layout(tipo_origem)["regras"]]
+    return hashlib.sha1(json.dumps(base).encode("utf-8")).hexdigest()
+
+
+def _ler_cache_relatorio(chave: str) -> Optional[pd.DataFrame]:
+    arq = CACHE_RELATORIOS_DIR / f"{chave}.parquet"
+    if not arq.exists():
+        return None
     try:
-        res = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+        df = pd.read_parquet(arq)
+    except ImportError:
+        return None
     except Exception as exc:
-        log(f"[ERRO CONVERSAO] {exc}")
-        shutil.rmtree(tmpdir, ignore_errors=True)
+        log(f"[AVISO] Cache de relatorio ilegivel, descartado: {exc}")
+        try:
+            arq.unlink()
+        except OSError:
+            pass
         return None
+    try:
+        os.utime(arq)  # marca uso recente para a limpeza por tamanho
+    except OSError:
+        pass
+    return df
 
-    if res.returncode != 0:
-        log(f"[ERRO CONVERSAO] {res.stderr.strip() or res.stdout.strip()}")
-        shutil.rmtree(tmpdir, ignore_errors=True)
-        return None
 
-    candidatos = sorted(tmpdir.glob(f"{caminho_arquivo.stem}*.xlsx"), key=os.path.getmtime, reverse=True)
-    if not candidatos:
-        log("[ERRO CONVERSAO] Nenhum .xlsx gerado.")
-        shutil.rmtree(tmpdir, ignore_errors=True)
-        return None
+def _aplicar_limite_cache_relatorios():
+    try:
+        arquivos = [(a, a.stat()) for a in CACHE_RELATORIOS_DIR.glob("*.parquet")]
+    except OSError:
+        return
+    total = sum(st.st_size for _, st in arquivos)
+    limite = CACHE_RELATORIOS_MAX_MB * 1024 * 1024
+    # Remove os usados ha mais tempo ate caber no limite.
+    for arq, st in sorted(arquivos, key=lambda x: x[1].st_mtime):
+        if total <= limite:
+            break
+        try:
+            arq.unlink()
+            total -= st.st_size
+        except OSError:
+            pass
 
+
+def _gravar_cache_relatorio(chave: str, df: pd.DataFrame):
     try:
-        shutil.move(str(candidatos[0]), destino)
+        CACHE_RELATORIOS_DIR.mkdir(parents=True, exist_ok=True)
+        _gravar_atomico(CACHE_RELATORIOS_DIR / f"{chave}.parquet", df.to_parquet(index=False))
+    except ImportError:
+        return
     except Exception as exc:
-        log(f"[ERRO CONVERSAO] Falha ao mover arquivo convertido: {exc}")
-        shutil.rmtree(tmpdir, ignore_errors=True)
-        return None
+        log(f"[AVISO] Relatorio nao entrou no cache: {exc}")
+        return
+    _aplicar_limite_cache_relatorios()
+
+
+def limpar_cache_relatorios() -> int:
+    """Apaga o cache de relatorios, o registro de layouts e o estado das conciliacoes. Retorna quantos arquivos removeu."""
+    global _PLANOS_LAYOUT
+    _PLANOS_LAYOUT = None
+    removidos = 0
+    if not CACHE_RELATORIOS_DIR.exists():
+        return 0
+    for arq in [
+        *CACHE_RELATORIOS_DIR.glob("*.parquet*"),
+        *CACHE_RELATORIOS_DIR.glob(f"{REGISTRO_LAYOUTS.name}*"),
+        *ESTADO_CONCILIACAO_DIR.glob("*"),
+    ]:
+        try:
+            arq.unlink()
+            removidos += 1
+        except OSError as exc:
+            log(f"[AVISO] Nao foi possivel remover {arq.name}: {exc}")
+    return removidos
 
-    shutil.rmtree(tmpdir, ignore_errors=True)
-    return destino
 
+def carregar_relatorio(caminho_arquivo: Path, tipo_origem: str, usar_cache: bool = True) -> Optional[pd.DataFrame]:
+    """
+    ler_relatorio_projetado (ou preparar_em_blocos para .xlsx acima de STREAMING_ACIMA_MB),
+    reaproveitando o resultado em cache quando o arquivo nao mudou
+    (chave: caminho, tamanho, mtime, tipo, VERSAO_REGRAS_PARSER e regras do layout). Resultados vazios nao entram no cache.
+    None se o arquivo nao pode ser lido.
+    Medido como etapa "leitura" (bytes = tamanho do arquivo; preparo/agregacao/conversao internos contam a parte).
+    """
+    try:
+        tamanho = caminho_arquivo.stat().st_size
+    except OSError:
+        tamanho = 0
+    with etapa("leitura", num_bytes=tamanho) as contadores:
+        df = _carregar_relatorio(caminho_arquivo, tipo_origem, usar_cache)
+        contadores["linhas_saida"] = 0 if df is None else len(df)
+        return df
 
-def ler_arquivo(caminho_arquivo: Path) -> Optional[pd.DataFrame]:
-    log(f"Lendo arquivo: {caminho_arquivo.name}")
-    caminho_para_ler = converter_para_xlsx(caminho_arquivo)
-    if not caminho_para_ler:
-        log("[ERRO] Conversao/obtencao do arquivo falhou.")
+
+def relatorio_em_cache(caminho_arquivo: Path, tipo_origem: str) -> Optional[pd.DataFrame]:
+    """Relatorio ja preparado no cache (mesma chave de carregar_relatorio), sem abrir a planilha; None se nao houver."""
+    try:
+        chave = _chave_cache_relatorio(caminho_arquivo, tipo_origem)
+    except OSError:
         return None
+    return _ler_cache_relatorio(chave)
+
+
+def _carregar_relatorio(caminho_arquivo: Path, tipo_origem: str, usar_cache: bool) -> Optional[pd.DataFrame]:
+    chave = None
+    if usar_cache:
+        try:
+            chave = _chave_cache_relatorio(caminho_arquivo, tipo_origem)
+        except OSError:
+            chave = None
+        df = _ler_cache_relatorio(chave) if chave else None
+        if df is not None:
+            log(f"Relatorio em cache: {caminho_arquivo.name}")
+            return df
+    df = None
+    if _ler_em_blocos(caminho_arquivo):
+        try:
+            df = preparar_em_blocos(caminho_arquivo, tipo_origem)
+        except Exception as exc:
+            log(f"[AVISO] Leitura em blocos falhou, lendo o arquivo inteiro: {exc}")
+    if df is None:
+        df = ler_relatorio_projetado(caminho_arquivo, tipo_origem)
+    if chave and df is not None and not df.empty:
+        _gravar_cache_relatorio(chave, df)
+    return df
+
+
+def _inicializar_worker(fila_perfis=None):
+    global _FILA_PERFIS
+    _FILA_PERFIS = fila_perfis
+
+
+def _carregar_relatorio_isolado(
+    caminho_arquivo: Path, tipo_origem: str, usar_cache: bool
+) -> Tuple[Optional[pd.DataFrame], List[str], Dict[str, Dict[str, float]]]:
+    """
+    Roda carregar_relatorio num processo do pool e devolve as mensagens de log e as metricas das etapas
+    para o processo principal repassar.
+    """
+    mensagens: List[str] = []
+    set_logger(mensagens.append)
+    _METRICAS.clear()
     try:
-        df = pd.read_excel(caminho_para_ler, header=None, engine="openpyxl")
-        return preencher_mesclados(df)
+        with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+            return carregar_relatorio(caminho_arquivo, tipo_origem, usar_cache=usar_cache), mensagens, dict(_METRICAS)
     except Exception as exc:
-        log(f"[ERRO LEITURA] {exc}")
-        return None
+        mensagens.append(f"[ERRO LEITURA] {caminho_arquivo.name}: {exc}")
+        return None, mensagens, dict(_METRICAS)
+
+
+def carregar_relatorios(
+    arquivos: List[Tuple[Path, str]], usar_cache: bool = True, processos: Optional[int] = None
+) -> List[Optional[pd.DataFrame]]:
+    """
+    Le e prepara varios relatorios [(caminho, "DOMINIO"/"EMPRESA"), ...] em processos paralelos.
+    Os que estao no cache saem dele antes, sem pool; o pool so sobe para dois ou mais relatorios a ler.
+    O resultado sai na mesma ordem da entrada (log: primeiro os do cache); arquivo com erro vira None.
+    """
+    resultados: List[Optional[pd.DataFrame]] = [None] * len(arquivos)
+    ler = []
+    for i, (f, tipo) in enumerate(arquivos):
+        inicio = time.perf_counter()
+        df = relatorio_em_cache(f, tipo) if usar_cache else None
+        if df is None:
+            ler.append(i)
+            continue
+        registrar_etapa("leitura", time.perf_counter() - inicio, linhas_saida=len(df), num_bytes=f.stat().st_size)
+        log(f"Lendo {tipo}: {f.name}")
+        log(f"Relatorio em cache: {f.name}")
+        resultados[i] = df
+    if not ler:
+        return resultados
+    partes = _ler_relatorios([arquivos[i] for i in ler], usar_cache, processos)
+    for i, df in zip(ler, partes):
+        resultados[i] = df
+    return resultados
+
+
+def _ler_relatorios(
+    arquivos: List[Tuple[Path, str]], usar_cache: bool, processos: Optional[int]
+) -> List[Optional[pd.DataFrame]]:
+    processos = PROCESSOS_LEITURA if processos is None else processos
+    if processos <= 0:
+        processos = os.cpu_count() or 1
+    processos = min(processos, len(arquivos))
+
+    if processos > 1:
+        try:
+            with ProcessPoolExecutor(
+                max_workers=processos, initializer=_inicializar_worker, initargs=(_fila_perfis(),)
+            ) as pool:
+                futuros = [pool.submit(_carregar_relatorio_isolado, f, tipo, usar_cache) for f, tipo in arquivos]
+                resultados = []
+                for (f, tipo), fut in zip(arquivos, futuros):
+                    log(f"Lendo {tipo}: {f.name}")
+                    try:
+                        df, mensagens, metricas = fut.result()
+                    except Exception as exc:
+                        if isinstance(exc, BrokenProcessPool):
+                            _descartar_fila_perfis()
+                        df, mensagens, metricas = None, [f"[ERRO LEITURA] {f.name}: {exc}"], {}
+                    for msg in mensagens:
+                        log(msg)
+                    somar_metricas(metricas)
+                    resultados.append(df)
+                return resultados
+        except Exception as exc:
+            log(f"[AVISO] Leitura paralela indisponivel, seguindo em serie: {exc}")
+
+    resultados = []
+    for f, tipo in arquivos:
+        log(f"Lendo {tipo}: {f.name}")
+        try:
+            resultados.append(carregar_relatorio(f, tipo, usar_cache=usar_cache))
+        except Exception as exc:
+            log(f"[ERRO LEITURA] {f.name}: {exc}")
+            resultados.append(None)
+    return resultados
+
+
+def _inicio_notas(col: pd.Series) -> Optional[int]:
+    """Posicao da primeira nota valida (nem S/N nem 0) da coluna, ou None se nao houver."""
+    # A primeira nota valida costuma estar nas primeiras linhas: normaliza em blocos crescentes.
+    ini, bloco = 0, 64
+    while ini < len(col):
+        notas, _ = normalizar_notas_serie(col.iloc[ini : ini + bloco])
+        validas = ~notas.isin(["S/N", "0"]).to_numpy()
+        if validas.any():
+            return ini + int(validas.argmax())
+        ini += bloco
+        bloco *= 2
+    return None
 
 
 def cortar_inicio(df: pd.DataFrame, col_nota_idx: int) -> pd.DataFrame:
     if df is None or df.empty:
         return df
-    start_idx = 0
-    for i in range(len(df)):
-        nota_raw = df.iat[i, col_nota_idx] if col_nota_idx < df.shape[1] else None
-        nota_norm = normalizar_nota(nota_raw)
-        if nota_norm not in ("S/N", "0"):
-            start_idx = i
-            break
-    if start_idx > 0:
+    if col_nota_idx >= df.shape[1]:
+        return df
+    start_idx = _inicio_notas(df.iloc[:, col_nota_idx])
+    if start_idx:
         return df.iloc[start_idx:].reset_index(drop=True)
     return df
 
 
-def preparar_dataframe(df_raw: pd.DataFrame, tipo_origem: str) -> pd.DataFrame:
-    """
-    Detecta cabecalho e recorta colunas relevantes.
-    Dom: Nota col 4, Valor col 20, Data col 2
-    Emp: Nota col 12, Valor col 17, Data col 10, Status Nfe (quando existir)
-    """
-    if df_raw is None or df_raw.empty:
-        return pd.DataFrame(columns=["Nota", "Valor", "Data", "Codigo", "Status_NFE"])
+def _find_header_row(df: pd.DataFrame, must_have: List[str], max_rows: int = 30) -> Optional[int]:
+    lim = min(max_rows, len(df))
+    for i in range(lim):
+        row = df.iloc[i].astype(str).str.lower()
+        if all(row.str.contains(t, na=False, regex=False).any() for t in must_have):
+            return i
+    return None
+
+
+def _layout(tipo_origem: str) -> Dict:
+    # Qualquer tipo diferente de DOMINIO segue o layout da Empresa (como antes).
+    return LAYOUTS["DOMINIO"] if tipo_origem == "DOMINIO" else LAYOUTS["EMPRESA"]
+
+
+def localizar_cabecalho(df_topo: pd.DataFrame, tipo_origem: str) -> int:
+    """Linha do cabecalho nas primeiras linhas cruas (header=None) do relatorio; LINHA_CABECALHO do layout se nao achar."""
+    # Alguns relatórios do Domínio vêm com cabeçalho em linha fixa (5),
+    # e alguns relatórios de Empresa trazem cabeçalho por volta da linha 3.
+    layout = _layout(tipo_origem)
+    for termos in layout["cabecalho"]:
+        header_idx = _find_header_row(df_topo, must_have=termos, max_rows=layout["linhas_busca"])
+        if header_idx is not None:
+            return header_idx
+    return layout["linha_padrao"]
+
 
-    def _find_header_row(df: pd.DataFrame, must_have: List[str], max_rows: int = 30) -> Optional[int]:
-        lim = min(max_rows, len(df))
-        for i in range(lim):
-            row = df.iloc[i].astype(str).str.lower()
-            if all(row.str.contains(t, na=False, regex=False).any() for t in must_have):
+def _aplicar_regras(regras: List[Tuple[str, object]], nomes: List[str]) -> Optional[int]:
+    for tipo, arg in regras:
+        if tipo == "indice":
+            if arg < len(nomes):
+                return arg
+            continue
+        for i, c in enumerate(nomes):
+            if not isinstance(c, str) or not c:
+                continue
+            if (tipo == "igual" and c.strip() == arg) or (tipo == "contem" and all(t in c for t in arg)):
                 return i
+    return None
+
+
+def resolver_colunas(nomes: List[str], tipo_origem: str) -> Optional[Dict[str, Optional[int]]]:
+    """
+    Posicao de cada coluna usada, a partir dos nomes do cabecalho (ja em minusculas) e das regras do layout.
+    Padrao: Dom Nota col 4, Valor col 20, Data col 2; Emp Nota col 12, Valor col 17, Data col 10, Status NFe col 20.
+    Retorna None (com log) se o relatorio nao tem colunas suficientes.
+    """
+    layout = _layout(tipo_origem)
+    if len(nomes) < layout["min_colunas"]:
+        log(f"[ERRO] {tipo_origem}: colunas insuficientes")
         return None
+    colunas = {campo: _aplicar_regras(regras, nomes) for campo, regras in layout["colunas"].items()}
+    for campo in ("nota", "valor", "data"):
+        if colunas[campo] is None:
+            log(f"[ERRO] {tipo_origem}: coluna {campo} nao encontrada no cabecalho")
+            return None
+    return colunas
 
-    if isinstance(df_raw.columns[0], Integral):
-        # Alguns relatórios do Domínio vêm com cabeçalho em linha fixa (5),
-        # e alguns relatórios de Empresa trazem cabeçalho por volta da linha 3.
-        if len(df_raw) <= 6:
-            log("[ERRO] Planilha sem linhas suficientes para cabecalho")
-            return pd.DataFrame(columns=["Codigo", "Nota", "Valor", "Data", "Status_NFE"])
-
-        if tipo_origem == "EMPRESA":
-            header_idx = _find_header_row(df_raw, must_have=["n.nota", "status nfe"], max_rows=20)
-            if header_idx is None:
-                header_idx = _find_header_row(df_raw, must_have=["n.nota", "status"], max_rows=25)
-            if header_idx is None:
-                header_idx = _find_header_row(df_raw, must_have=["nota", "status"], max_rows=25)
-            if header_idx is None:
-                header_idx = 5
-        else:
-            header_idx = _find_header_row(df_raw, must_have=["nota", "valor"], max_rows=20)
-            if header_idx is None:
-                header_idx = 5
 
-        df_raw.columns = df_raw.iloc[header_idx].astype(str).str.lower().str.strip()
-        df_raw = df_raw.iloc[header_idx + 1 :].reset_index(drop=True)
-    else:
-        df_raw.columns = df_raw.columns.astype(str).str.lower().str.strip()
+def _nomes_cabecalho(df_topo: pd.DataFrame, header_idx: int) -> List[str]:
+    return df_topo.iloc[header_idx].astype(str).str.lower().str.strip().tolist()
+
+
+def _planos_layout() -> Dict[str, Dict]:
+    global _PLANOS_LAYOUT
+    if _PLANOS_LAYOUT is None:
+        try:
+            with open(REGISTRO_LAYOUTS, "r", encoding="utf-8") as fh:
+                _PLANOS_LAYOUT = json.load(fh)
+        except (OSError, ValueError):
+            _PLANOS_LAYOUT = {}
+    return _PLANOS_LAYOUT
+
+
+def _registrar_plano(chave: str, plano: Dict):
+    global _PLANOS_LAYOUT
+    _planos_layout()[chave] = plano
+    try:
+        # Relê o arquivo antes de gravar: outro processo pode ter registrado layouts no meio tempo.
+        try:
+            with open(REGISTRO_LAYOUTS, "r", encoding="utf-8") as fh:
+                dados = json.load(fh)
+        except (OSError, ValueError):
+            dados = {}
+        dados.update(_PLANOS_LAYOUT)
+        REGISTRO_LAYOUTS.parent.mkdir(parents=True, exist_ok=True)
+        _gravar_atomico(REGISTRO_LAYOUTS, json.dumps(dados, ensure_ascii=False, indent=1).encode("utf-8"))
+        _PLANOS_LAYOUT = dados
+    except OSError as exc:
+        log(f"[AVISO] Registro de layouts nao gravado: {exc}")
+
+
+def _chave_plano(plano: Dict) -> str:
+    return hashlib.sha1(json.dumps([plano["tipo"], plano["regras"], plano["cabecalho"], plano["nomes"]]).encode("utf-8")).hexdigest()
+
 
-    mask_total = df_raw.apply(lambda r: r.astype(str).str.contains("total", case=False, na=False)).any(axis=1)
+def _cabecalho_reconhecido(nomes: List[str], tipo_origem: str) -> bool:
+    """A linha (nomes ja em minusculas) tem todos os textos de alguma alternativa de CABECALHO do layout."""
+    return any(
+        all(any(isinstance(n, str) and t in n for n in nomes) for t in termos) for termos in _layout(tipo_origem)["cabecalho"]
+    )
+
+
+def plano_extracao(df_topo: pd.DataFrame, tipo_origem: str) -> Optional[Dict]:
+    """
+    Cabecalho e colunas do relatorio a partir das primeiras linhas cruas: {"cabecalho", "n_colunas", "colunas"}.
+    Layout ja visto (mesma linha de cabecalho com os mesmos nomes, mesmas regras) vem do registro em disco;
+    layout novo passa por localizar_cabecalho + resolver_colunas e entra no registro.
+    So cabecalho reconhecido por CABECALHO entra ou sai do registro: a linha de reserva (LINHA_CABECALHO) nao
+    identifica o layout, e reaproveitada poderia cortar as linhas de dados de outro relatorio.
+    """
+    regras = _layout(tipo_origem)["regras"]
+    nomes_linha: Dict[int, List[str]] = {}
+    for plano in _planos_layout().values():
+        idx = plano.get("cabecalho")
+        if plano.get("tipo") != tipo_origem or plano.get("regras") != regras or not isinstance(idx, int) or idx >= len(df_topo):
+            continue
+        if idx not in nomes_linha:
+            nomes_linha[idx] = _nomes_cabecalho(df_topo, idx)
+        if nomes_linha[idx] == plano.get("nomes") and _cabecalho_reconhecido(nomes_linha[idx], tipo_origem):
+            return plano
+
+    header_idx = localizar_cabecalho(df_topo, tipo_origem)
+    nomes = _nomes_cabecalho(df_topo, header_idx)
+    colunas = resolver_colunas(nomes, tipo_origem)
+    if colunas is None:
+        return None
+    plano = {
+        "tipo": tipo_origem,
+        "regras": regras,
+        "cabecalho": header_idx,
+        "nomes": nomes,
+        "n_colunas": len(nomes),
+        "colunas": colunas,
+    }
+    if not _cabecalho_reconhecido(nomes, tipo_origem):
+        log(f"[AVISO] Cabecalho de {tipo_origem} nao reconhecido, usando a linha {header_idx + 1} (layout nao registrado)")
+        return plano
+    log(f"Layout novo de {tipo_origem} registrado (cabecalho na linha {header_idx + 1})")
+    _registrar_plano(_chave_plano(plano), plano)
+    return plano
+
+
+@medir_etapa("preparo")
+def extrair_notas(
+    df_dados: pd.DataFrame, colunas: Dict[str, Optional[int]], cortar: bool = True, layout: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    Recorta as linhas de dados (abaixo do cabecalho) nas colunas de resolver_colunas e normaliza Nota/Valor/Data.
+    Descarta linhas de total, notas sem numero e valores zerados; cortar=False mantem as linhas antes da primeira nota valida.
+    Filtros baratos primeiro: Data, Codigo e Status so sao lidos nas linhas que sobram (formato da data por layout).
+    """
+    vazio = notas_vazias()
+    if df_dados is None or df_dados.empty:
+        return vazio
+
+    mask_total = detectar_linhas_total(df_dados)
     if mask_total.any():
-        df_raw = df_raw.loc[~mask_total].reset_index(drop=True)
-
-    if tipo_origem == "DOMINIO":
-        if len(df_raw.columns) <= 22:
-            log("[ERRO] DOMINIO: colunas insuficientes")
-            return pd.DataFrame(columns=["Codigo", "Nota", "Valor", "Data", "Status_NFE"])
-        col_nota = next(
-            (c for c in df_raw.columns if isinstance(c, str) and c.strip() == "nota"),
-            None,
-        ) or df_raw.columns[4]
-        col_data = next(
-            (c for c in df_raw.columns if isinstance(c, str) and c.strip() == "data"),
-            None,
-        ) or df_raw.columns[2]
-        col_valor = next(
-            (c for c in df_raw.columns if isinstance(c, str) and "valor cont" in c),
-            None,
-        ) or df_raw.columns[20]
-        col_cod = None
-        col_status = None
-        df_raw = cortar_inicio(df_raw, df_raw.columns.get_loc(col_nota))
-        valor_series = df_raw[col_valor]
-        data_series = parse_data(df_raw[col_data])
-    else:
-        if len(df_raw.columns) <= 17:
-            log("[ERRO] EMPRESA: colunas insuficientes")
-            return pd.DataFrame(columns=["Codigo", "Nota", "Valor", "Data", "Status_NFE"])
-        col_nota = next(
-            (c for c in df_raw.columns if isinstance(c, str) and "n.nota" in c),
-            None,
-        ) or df_raw.columns[12]
-        # Preferência: "Total Nota" (valor total do documento). Se não existir, tenta "Total Produtos".
-        col_valor = (
-            next((c for c in df_raw.columns if isinstance(c, str) and "total nota" in c), None)
-            or next((c for c in df_raw.columns if isinstance(c, str) and "total produtos" in c), None)
-            or (df_raw.columns[17] if len(df_raw.columns) > 17 else df_raw.columns[-1])
-        )
-        col_data = next(
-            (c for c in df_raw.columns if isinstance(c, str) and ("dt.emiss" in c or "dt.emissão" in c)),
-            None,
-        ) or df_raw.columns[10]
-        col_cod = None
-        df_raw = cortar_inicio(df_raw, df_raw.columns.get_loc(col_nota))
-        valor_series = df_raw[col_valor]
-        data_series = parse_data(df_raw[col_data])
-        # Status NFe fica na coluna U (indice 20) no relatório Empresa.
-        col_status = df_raw.columns[20] if len(df_raw.columns) > 20 else None
-        if col_status is None:
-            col_status = next(
-                (c for c in df_raw.columns if isinstance(c, str) and "status" in c and "nfe" in c),
-                None,
-            )
+        df_dados = df_dados.loc[~mask_total].reset_index(drop=True)
+    if cortar:
+        df_dados = cortar_inicio(df_dados, colunas["nota"])
+
+    def coluna(pos: Optional[int]):
+        if pos is None:
+            return ""
+        if pos >= df_dados.shape[1]:
+            return pd.Series(np.nan, index=df_dados.index, dtype=object)
+        return df_dados.iloc[:, pos]
 
     try:
         df_new = pd.DataFrame({
-            "Nota": df_raw[col_nota],
-            "Valor": valor_series,
-            "Data": data_series,
+            "Nota": coluna(colunas["nota"]),
+            "Valor": coluna(colunas["valor"]),
         })
-        if col_cod:
-            df_new["Codigo"] = df_raw[col_cod]
-        else:
-            df_new["Codigo"] = ""
-        if col_status:
-            df_new["Status_NFE"] = df_raw[col_status]
-        else:
-            df_new["Status_NFE"] = ""
+        chave = normalizar_notas_serie(df_new["Nota"])[1]
+        valor = converter_para_float_serie(df_new["Valor"])
+        manter = (chave.notna() & (valor > 0.01)).to_numpy()
+        df_dados = df_dados.loc[manter]
+
+        # Chave inteira da nota (sem <NA> apos o filtro) e valor em centavos: merge, soma e ordenacao sobre inteiros.
+        df_new = pd.DataFrame(
+            {
+                "Nota": chave[manter].astype("int64"),
+                "Centavos": np.rint(valor[manter] * 100).astype("int64"),
+            }
+        )
+        df_new["Data"] = parse_data(coluna(colunas["data"]), layout=layout)
+        df_new["Codigo"] = _categoria(coluna(colunas.get("codigo")), df_new.index)
+        df_new["Status_NFE"] = _categoria(coluna(colunas.get("status")), df_new.index)
     except Exception as exc:
         log(f"[ERRO] Recorte de colunas: {exc}")
-        return pd.DataFrame(columns=["Codigo", "Nota", "Valor", "Data", "Status_NFE"])
+        return vazio
 
-    df_new["Nota"] = df_new["Nota"].apply(normalizar_nota)
-    df_new["Valor"] = df_new["Valor"].apply(converter_para_float)
+    return df_new[COLUNAS_NOTAS]
 
-    df_new["Nota_num"] = pd.to_numeric(df_new["Nota"], errors="coerce")
-    df_new = df_new[
-        df_new["Nota_num"].notna()
-        & (df_new["Valor"] > 0.01)
-    ]
 
-    return df_new.drop(columns=["Nota_num"])
+def preparar_dataframe(df_raw: pd.DataFrame, tipo_origem: str) -> pd.DataFrame:
+    """Detecta cabecalho e recorta colunas relevantes (plano_extracao + extrair_notas)."""
+    if df_raw is None or df_raw.empty:
+        return notas_vazias()
+
+    if isinstance(df_raw.columns[0], Integral):
+        if len(df_raw) <= 6:
+            log("[ERRO] Planilha sem linhas suficientes para cabecalho")
+            return notas_vazias()
+        plano = plano_extracao(df_raw, tipo_origem)
+        colunas = plano["colunas"] if plano else None
+        layout = _chave_plano(plano) if plano else None
+        if plano:
+            df_raw = df_raw.iloc[plano["cabecalho"] + 1 :].reset_index(drop=True)
+    else:
+        colunas = resolver_colunas(df_raw.columns.astype(str).str.lower().str.strip().tolist(), tipo_origem)
+        layout = None
+
+    if colunas is None:
+        return notas_vazias()
+    return extrair_notas(df_raw, colunas, layout=layout)
+
+
+def _ler_em_blocos(caminho_arquivo: Path) -> bool:
+    if STREAMING_ACIMA_MB <= 0 or caminho_arquivo.suffix.lower() != ".xlsx":
+        return False
+    try:
+        return caminho_arquivo.stat().st_size >= STREAMING_ACIMA_MB * 1024 * 1024
+    except OSError:
+        return False
+
+
+def preparar_em_blocos(caminho_arquivo: Path, tipo_origem: str, linhas_por_bloco: Optional[int] = None) -> pd.DataFrame:
+    """
+    preparar_dataframe em streaming para .xlsx grandes: percorre a planilha com o iterador read-only do openpyxl
+    em blocos de linhas_por_bloco, agrega as notas de cada bloco e junta os parciais.
+    A memoria fica limitada ao bloco + notas distintas; o resultado ja sai agregado por nota.
+    """
+    linhas_por_bloco = linhas_por_bloco or LINHAS_POR_BLOCO
+    vazio = notas_vazias()
+    log(f"Lendo arquivo em blocos: {caminho_arquivo.name}")
+    linhas = _linhas_openpyxl(caminho_arquivo)
+    try:
+        topo = list(itertools.islice(linhas, 30))
+        if len(topo) <= 6:
+            log("[ERRO] Planilha sem linhas suficientes para cabecalho")
+            return vazio
+        df_topo = pd.DataFrame(topo)
+        plano = plano_extracao(df_topo.mask(df_topo.isin(VALORES_VAZIOS)), tipo_origem)
+        if plano is None:
+            return vazio
+        colunas, layout = plano["colunas"], _chave_plano(plano)
+
+        parciais: List[pd.DataFrame] = []
+        # Blocos antes da primeira nota valida: descartados quando ela aparece (como cortar_inicio), mantidos se nunca aparecer.
+        antes_inicio: List[pd.DataFrame] = []
+        iniciado = False
+        bloco = topo[plano["cabecalho"] + 1 :]
+        while True:
+            bloco.extend(itertools.islice(linhas, max(0, linhas_por_bloco - len(bloco))))
+            if not bloco:
+                break
+            fim = len(bloco) < linhas_por_bloco
+            df_b = pd.DataFrame(bloco)
+            bloco = []
+            if df_b.shape[1] < plano["n_colunas"]:
+                df_b = df_b.reindex(columns=range(plano["n_colunas"]))
+            mask_total = detectar_linhas_total(df_b)
+            if mask_total.any():
+                df_b = df_b.loc[~mask_total].reset_index(drop=True)
+
+            if not iniciado:
+                inicio = _inicio_notas(df_b.iloc[:, colunas["nota"]])
+                if inicio is None:
+                    antes_inicio.append(agregar_por_nota(extrair_notas(df_b, colunas, cortar=False, layout=layout)))
+                else:
+                    df_b = df_b.iloc[inicio:].reset_index(drop=True)
+                    iniciado = True
+                    antes_inicio = []
+            if iniciado:
+                parcial = agregar_por_nota(extrair_notas(df_b, colunas, cortar=False, layout=layout))
+                if not parcial.empty:
+                    parciais.append(parcial)
+                # Junta os parciais de tempos em tempos para nao acumular um por bloco.
+                if sum(len(p) for p in parciais) > linhas_por_bloco:
+                    parciais = [agregar_por_nota(juntar_notas(parciais))]
+            if fim:
+                break
+    finally:
+        linhas.close()
+
+    if not iniciado:
+        parciais = [p for p in antes_inicio if not p.empty]
+    if not parciais:
+        return vazio
+    return agregar_por_nota(juntar_notas(parciais))
 
 
 def extrair_ano(mes_ano: str) -> str:
@@ -414,8 +1635,613 @@ def resolver_bases(mes_ano: str) -> List[str]:
     return resolved
 
 
-def processar_empresa(empresa: str, pasta_base: str, mes_ano: str, arquivo_dom: Optional[str] = None, arquivo_emp: Optional[str] = None):
+def notas_vazias() -> pd.DataFrame:
+    """Tabela de notas sem linhas, ja com os tipos de COLUNAS_NOTAS."""
+    return pd.DataFrame(
+        {
+            "Codigo": pd.Categorical([]),
+            "Nota": pd.Series(dtype="int64"),
+            "Centavos": pd.Series(dtype="int64"),
+            "Data": pd.Series(dtype="datetime64[ns]"),
+            "Status_NFE": pd.Categorical([]),
+        }
+    )
+
+
+def _mascarar_vazios(serie: pd.Series) -> pd.Series:
+    """Troca por NA as celulas vazias ou so com espacos (testa cada valor distinto uma vez)."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        vazias = [c for c in serie.cat.categories if isinstance(c, str) and not c.strip()]
+        return serie.cat.remove_categories(vazias) if vazias else serie
+    if not pd.api.types.is_object_dtype(serie.dtype) and not pd.api.types.is_string_dtype(serie.dtype):
+        return serie
+    codigos, distintos = pd.factorize(serie.to_numpy(dtype=object))
+    vazio_d = np.array([isinstance(v, str) and not v.strip() for v in distintos] + [True], dtype=bool)
+    return serie.astype(object).mask(vazio_d[codigos])
+
+
+def _categoria(valores, index: pd.Index) -> pd.Series:
+    """Coluna de texto repetido (Codigo, Status NFe) como categorica; vazios e celulas so com espacos viram NA."""
+    if not isinstance(valores, pd.Series):
+        valores = pd.Series(valores, index=index, dtype=object)
+    return _mascarar_vazios(valores).astype("category")
+
+
+def juntar_notas(partes: List[pd.DataFrame]) -> pd.DataFrame:
+    """pd.concat de tabelas de notas mantendo Codigo/Status_NFE categoricos (categorias unidas antes)."""
+    partes = [p for p in partes if p is not None and not p.empty]
+    if not partes:
+        return notas_vazias()
+    for c in ("Codigo", "Status_NFE"):
+        try:
+            tipo = pd.CategoricalDtype(union_categoricals([p[c].astype("category") for p in partes]).categories)
+        except TypeError:
+            continue  # categorias de tipos diferentes (ex.: texto e numero): a coluna fica object no concat
+        partes = [p.assign(**{c: p[c].astype(tipo)}) for p in partes]
+    return pd.concat(partes, ignore_index=True)
+
+
+@medir_etapa("agregacao")
+def agregar_por_nota(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Soma os centavos por Nota (a mesma nota aparece uma vez por CFOP).
+    Codigo/Status_NFE ficam com o primeiro valor nao vazio do grupo, via groupby.first sobre os vazios mascarados.
+    Entrada e saida em COLUNAS_NOTAS, entao o resultado pode ser agregado de novo (parciais da leitura em blocos).
+    """
+    if df is None or df.empty:
+        return notas_vazias()
+    out = df[COLUNAS_NOTAS].copy()
+    out["Codigo"] = _mascarar_vazios(out["Codigo"])
+    out["Status_NFE"] = _mascarar_vazios(out["Status_NFE"])
+
+    grouped = (
+        out.groupby("Nota", sort=True, as_index=False)
+        .agg(
+            Centavos=("Centavos", "sum"),
+            Data=("Data", "min"),
+            Codigo=("Codigo", "first"),
+            Status_NFE=("Status_NFE", "first"),
+        )
+    )
+    grouped["Codigo"] = _categoria(grouped["Codigo"], grouped.index)
+    grouped["Status_NFE"] = _categoria(grouped["Status_NFE"], grouped.index)
+    return grouped[COLUNAS_NOTAS]
+
+
+def juntar_por_nota(chaves_dom, chaves_emp) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Outer join das chaves de nota dos dois lados (int64, sem repeticao, como sai de agregar_por_nota).
+    Retorna (chaves da uniao em ordem crescente, posicao de cada chave em dom, posicao em emp), -1 onde o lado nao tem a nota.
+    Com as chaves ja ordenadas (caso normal) nao ha hash nem reordenacao: uniao por sort estavel de duas sequencias
+    ordenadas e posicoes por searchsorted.
+    """
+    lados = []
+    for chaves in (chaves_dom, chaves_emp):
+        chaves = np.asarray(chaves, dtype="int64")
+        ordem = None
+        if len(chaves) > 1 and not (chaves[1:] > chaves[:-1]).all():
+            ordem = np.argsort(chaves, kind="stable")
+            chaves = chaves[ordem]
+        lados.append((chaves, ordem))
+
+    todas = np.sort(np.concatenate([lados[0][0], lados[1][0]]), kind="stable")
+    uniao = todas[np.concatenate([[True], todas[1:] != todas[:-1]])] if len(todas) else todas
+
+    posicoes = []
+    for chaves, ordem in lados:
+        pos = np.searchsorted(chaves, uniao)
+        achou = pos < len(chaves)
+        achou[achou] = chaves[pos[achou]] == uniao[achou]
+        if ordem is not None:
+            pos[achou] = ordem[pos[achou]]
+        posicoes.append(np.where(achou, pos, -1))
+    return uniao, posicoes[0], posicoes[1]
+
+
+def _nas_posicoes(valores: np.ndarray, pos: np.ndarray, vazio) -> np.ndarray:
+    """valores[pos], com vazio onde pos == -1 (lado sem a nota)."""
+    return np.append(valores, np.array([vazio], dtype=valores.dtype))[pos]
+
+
+@medir_etapa("classificacao")
+def classificar_status(
+    tem_dom: np.ndarray,
+    tem_emp: np.ndarray,
+    diferenca: np.ndarray,
+    tolerancia: float = TOLERANCIA,
+    inutilizada: Optional[np.ndarray] = None,
+) -> pd.Categorical:
+    """
+    Status por nota a partir dos lados presentes (juntar_por_nota) e da diferenca Dom - Emp em reais.
+    Inutilizada tem prioridade; So Dominio / So Empresa pelo lado; nas notas dos dois lados, Divergencia Valor acima da tolerancia.
+    """
+    tem_dom = np.asarray(tem_dom, dtype=bool)
+    tem_emp = np.asarray(tem_emp, dtype=bool)
+    if inutilizada is None:
+        inutilizada = np.zeros(len(tem_dom), dtype=bool)
+    codigos = np.select(
+        [inutilizada, ~tem_emp, ~tem_dom, np.abs(np.asarray(diferenca, dtype="float64")) > tolerancia],
+        [
+            STATUS_CATEGORIAS.index("Inutilizada"),
+            STATUS_CATEGORIAS.index("So Dominio"),
+            STATUS_CATEGORIAS.index("So Empresa"),
+            STATUS_CATEGORIAS.index("Divergencia Valor"),
+        ],
+        default=STATUS_CATEGORIAS.index("OK"),
+    )
+    return pd.Categorical.from_codes(codigos, categories=STATUS_CATEGORIAS)
+
+
+def mascara_inutilizadas(df_e_g: pd.DataFrame) -> np.ndarray:
+    """Notas da empresa com Status NFe inutilizada ("I"). Status_NFE e categorico: o teste roda uma vez por categoria."""
+    status = df_e_g["Status_NFE"].astype("category").cat
+    status_norm = pd.Series(status.categories.astype(str)).str.strip().str.upper()
+    inut_cat = np.append((status_norm.eq("I") | status_norm.str.startswith("I ")).to_numpy(), False)  # codigo -1 (vazio) -> False
+    return inut_cat[status.codes.to_numpy()]
+
+
+@medir_etapa("juncao", entrada=lambda args: len(args[0]) + len(args[1]))
+def conciliar_notas(df_d_g: pd.DataFrame, df_e_g: pd.DataFrame) -> pd.DataFrame:
+    """
+    Conciliacao por nota dos dois lados agregados: Codigo, Nota, Centavos_Dom, Centavos_Emp, Diferenca, Status, em ordem de nota.
+    Cada linha so depende da propria nota nos dois lados (base da conciliacao incremental).
+    """
+    # Outer join pela chave inteira (lados ja ordenados por nota): o resultado sai na ordem final, sem sort.
+    # Nota inutilizada fica com o lado Empresa (status proprio, nao "So Empresa"); o lado Dominio dela e descartado.
+    notas, pos_d, pos_e = juntar_por_nota(df_d_g["Nota"].to_numpy(), df_e_g["Nota"].to_numpy())
+    tem_e = pos_e >= 0
+    inut = _nas_posicoes(mascara_inutilizadas(df_e_g), pos_e, False)
+    tem_d = (pos_d >= 0) & ~inut
+    pos_d = np.where(tem_d, pos_d, -1)
+    dom = _nas_posicoes(df_d_g["Centavos"].to_numpy(), pos_d, 0)
+    emp = _nas_posicoes(df_e_g["Centavos"].to_numpy(), pos_e, 0)
+    return pd.DataFrame(
+        {
+            "Codigo": np.where(
+                tem_d,
+                _nas_posicoes(df_d_g["Codigo"].to_numpy(dtype=object), pos_d, None),
+                _nas_posicoes(df_e_g["Codigo"].to_numpy(dtype=object), pos_e, None),
+            ),
+            "Nota": notas,
+            "Centavos_Dom": dom,
+            "Centavos_Emp": emp,
+            "Diferenca": dom - emp,
+            "Status": classificar_status(tem_d, tem_e, (dom - emp) / 100, inutilizada=inut),
+        }
+    )
+
+
+def atualizar_conciliacao(
+    anterior: pd.DataFrame, df_d_g: pd.DataFrame, df_e_g: pd.DataFrame, afetadas: np.ndarray
+) -> pd.DataFrame:
+    """Refaz conciliar_notas so nas notas afetadas; as demais linhas vem da conciliacao anterior."""
+    if not len(afetadas):
+        return anterior
+    novas = conciliar_notas(df_d_g[df_d_g["Nota"].isin(afetadas)], df_e_g[df_e_g["Nota"].isin(afetadas)])
+    mantidas = anterior[~anterior["Nota"].isin(afetadas)]
+    df = pd.concat([mantidas, novas], ignore_index=True)
+    return df.sort_values("Nota", kind="stable", ignore_index=True)
+
+
+def status_alterado(anterior: pd.DataFrame, atual: pd.DataFrame, afetadas: np.ndarray) -> pd.DataFrame:
+    """Notas afetadas cujo status mudou: Nota, Status_Anterior, Status_Atual (vazio onde a nota nao existe)."""
+    antes = anterior.loc[anterior["Nota"].isin(afetadas), ["Nota", "Status"]].astype({"Status": object})
+    depois = atual.loc[atual["Nota"].isin(afetadas), ["Nota", "Status"]].astype({"Status": object})
+    df = pd.merge(antes, depois, on="Nota", how="outer", suffixes=("_Anterior", "_Atual"), sort=True)
+    df = df.fillna({"Status_Anterior": "", "Status_Atual": ""})
+    return df[df["Status_Anterior"] != df["Status_Atual"]].reset_index(drop=True)
+
+
+def sugerir_correspondencias(
+    dom: pd.DataFrame,
+    emp: pd.DataFrame,
+    tolerancia: float = TOLERANCIA,
+    janela_dias: int = JANELA_DIAS,
+    max_candidatos: int = MAX_CANDIDATOS,
+) -> pd.DataFrame:
+    """
+    Pares provaveis entre notas sem correspondencia (dom = So Dominio, emp = So Empresa, em COLUNAS_NOTAS),
+    tipicamente a mesma nota digitada com outro numero: |Centavos| ate a tolerancia e |Data| ate janela_dias.
+    emp fica num array ordenado pela chave (centavos, dia); para cada valor da faixa de tolerancia, as notas de dom
+    acham seus candidatos por searchsorted: O(n log n) por centavo de tolerancia, sem laco aninhado. No maximo
+    max_candidatos por nota e valor (notas de dom com a mesma chave comecam em candidatos diferentes).
+    Cada nota entra em um par so, os mais proximos em valor, data e numero primeiro.
+    Retorna Nota_Dom, Nota_Emp, Data_Dom, Data_Emp, Centavos_Dom, Centavos_Emp (notas sem data ficam de fora).
+    """
+    colunas = ["Nota_Dom", "Nota_Emp", "Data_Dom", "Data_Emp", "Centavos_Dom", "Centavos_Emp"]
+    dom = dom[dom["Data"].notna()]
+    emp = emp[emp["Data"].notna()]
+    if dom.empty or emp.empty:
+        return pd.DataFrame(columns=colunas)
+    tol = int(round(tolerancia * 100))
+    escala = 1 << 24  # dias por valor na chave composta (folga para qualquer data)
+    v_dom = dom["Centavos"].to_numpy(dtype="int64")
+    v_emp = emp["Centavos"].to_numpy(dtype="int64")
+    d_dom = dom["Data"].to_numpy(dtype="datetime64[D]").astype("int64")
+    d_emp = emp["Data"].to_numpy(dtype="datetime64[D]").astype("int64")
+    chave_dom = v_dom * escala + d_dom
+    chave_emp = v_emp * escala + d_emp
+    ordem = np.argsort(chave_emp, kind="stable")
+    chave_ord = chave_emp[ordem]
+
+    # Posicao de cada nota de dom entre as de mesma chave: espalha o inicio da janela de candidatos.
+    ordem_dom = np.argsort(chave_dom, kind="stable")
+    chave_dom_ord = chave_dom[ordem_dom]
+    rank = np.empty(len(dom), dtype="int64")
+    rank[ordem_dom] = np.arange(len(dom)) - np.searchsorted(chave_dom_ord, chave_dom_ord, side="left")
+
+    lista_i, lista_j = [], []
+    for dv in range(-tol, tol + 1):
+        base = (v_dom + dv) * escala + d_dom
+        ini = np.searchsorted(chave_ord, base - janela_dias, side="left")
+        fim = np.searchsorted(chave_ord, base + janela_dias, side="right")
+        ini = ini + np.clip(fim - ini - max_candidatos, 0, None).clip(max=rank)
+        fim = np.minimum(fim, ini + max_candidatos)
+        qtd = np.maximum(fim - ini, 0)
+        if not qtd.any():
+            continue
+        # Expande as faixas em pares (i de dom, j de emp) sem laco Python.
+        lista_i.append(np.repeat(np.arange(len(dom)), qtd))
+        deslocamento = np.arange(int(qtd.sum())) - np.repeat(np.cumsum(qtd) - qtd, qtd)
+        lista_j.append(ordem[np.repeat(ini, qtd) + deslocamento])
+    if not lista_i:
+        return pd.DataFrame(columns=colunas)
+    i, j = np.concatenate(lista_i), np.concatenate(lista_j)
+
+    n_dom = dom["Nota"].to_numpy(dtype="int64")
+    n_emp = emp["Nota"].to_numpy(dtype="int64")
+    # Mais proximos primeiro: diferenca de valor, depois de data, depois de numero da nota.
+    prioridade = np.lexsort((np.abs(n_dom[i] - n_emp[j]), np.abs(d_dom[i] - d_emp[j]), np.abs(v_dom[i] - v_emp[j])))
+    usado_dom = np.zeros(len(dom), dtype=bool)
+    usado_emp = np.zeros(len(emp), dtype=bool)
+    pares = []
+    for a, b in zip(i[prioridade].tolist(), j[prioridade].tolist()):
+        if not usado_dom[a] and not usado_emp[b]:
+            usado_dom[a] = usado_emp[b] = True
+            pares.append((a, b))
+    a, b = (np.array(x, dtype="int64") for x in zip(*pares))
+    ordem_saida = np.argsort(n_dom[a], kind="stable")
+    a, b = a[ordem_saida], b[ordem_saida]
+    return pd.DataFrame(
+        {
+            "Nota_Dom": n_dom[a],
+            "Nota_Emp": n_emp[b],
+            "Data_Dom": dom["Data"].to_numpy()[a],
+            "Data_Emp": emp["Data"].to_numpy()[b],
+            "Centavos_Dom": v_dom[a],
+            "Centavos_Emp": v_emp[b],
+        }
+    )
+
+
+# Indice das pastas lidas na busca dos relatorios: um os.scandir por pasta, consultas em memoria.
+# Vale para a execucao (empresas do mesmo mes reaproveitam as pastas em comum); run_conciliacao limpa no inicio.
+_INDICE_PASTAS: Dict[str, Optional[Dict]] = {}
+_CHAMADAS_FS = 0
+
+
+def limpar_indice_pastas():
+    _INDICE_PASTAS.clear()
+
+
+def _listar_pasta(pasta: Path) -> Optional[Dict]:
+    """
+    Conteudo da pasta: {"arquivos": {nome minusculo: Path}, "pastas": {nome minusculo: Path}, "por_keyword": {kw: [Path]}}.
+    None se a pasta nao existe. Cada pasta e lida uma vez por execucao.
+    """
+    global _CHAMADAS_FS
+    chave = os.path.normcase(os.path.abspath(pasta))
+    if chave in _INDICE_PASTAS:
+        return _INDICE_PASTAS[chave]
+    _CHAMADAS_FS += 1
+    try:
+        with os.scandir(pasta) as it:
+            entradas = list(it)
+    except OSError:
+        _INDICE_PASTAS[chave] = None
+        return None
+    indice: Dict = {"arquivos": {}, "pastas": {}, "por_keyword": {KEYWORD_DOMINIO: [], KEYWORD_EMPRESA: []}}
+    for e in sorted(entradas, key=lambda e: e.name):
+        try:
+            eh_pasta = e.is_dir()
+        except OSError:
+            continue
+        if eh_pasta:
+            indice["pastas"].setdefault(e.name.lower(), Path(e.path))
+            continue
+        indice["arquivos"].setdefault(e.name.lower(), Path(e.path))
+        if e.name.startswith("~$"):
+            continue
+        up = e.name.upper()
+        for kw, lista in indice["por_keyword"].items():
+            if kw in up:
+                lista.append(Path(e.path))
+    _INDICE_PASTAS[chave] = indice
+    return indice
+
+
+def _procurar_por_nome(raiz: Path, nome: str) -> Optional[Path]:
+    """Arquivo com o nome (sem diferenciar maiusculas) na raiz ou em qualquer subpasta, lendo cada pasta uma vez."""
+    alvo = nome.lower()
+    pendentes = [raiz]
+    while pendentes:
+        indice = _listar_pasta(pendentes.pop(0))
+        if indice is None:
+            continue
+        if alvo in indice["arquivos"]:
+            return indice["arquivos"][alvo]
+        pendentes.extend(indice["pastas"].values())
+    return None
+
+
+def _pasta_staging(pasta: Path) -> Path:
+    chave = hashlib.sha1(os.path.normcase(os.path.abspath(pasta)).encode("utf-8")).hexdigest()[:12]
+    return STAGING_DIR / f"{pasta.name}_{chave}"
+
+
+def espelhar_arquivos(arquivos: List[Path], origem: Path, destino: Path) -> Tuple[List[Path], int]:
+    """
+    Copia os arquivos (de origem ou de suas subpastas) para destino, mantendo a estrutura.
+    So copia o que mudou (tamanho ou mtime diferente da copia local), e a copia fica com o mtime do original.
+    Retorna (caminhos locais na mesma ordem, quantos foram copiados).
+    """
+    locais, copiados = [], 0
+    for f in arquivos:
+        local = destino / f.relative_to(origem)
+        st = f.stat()
+        try:
+            st_local = local.stat()
+            igual = st_local.st_size == st.st_size and st_local.st_mtime_ns == st.st_mtime_ns
+        except OSError:
+            igual = False
+        if not igual:
+            local.parent.mkdir(parents=True, exist_ok=True)
+            tmp = local.with_name(f"{local.name}.{os.getpid()}.tmp")
+            shutil.copyfile(f, tmp)
+            os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+            os.replace(tmp, local)
+            copiados += 1
+        locais.append(local)
+    return locais, copiados
+
+
+def publicar_arquivo(origem: Path, destino: Path):
+    """
+    Coloca origem em destino sem deixar arquivo pela metade: de outra pasta, copia primeiro para um temporario
+    ao lado do destino; a troca final e um os.replace (rename atomico no mesmo volume). origem deixa de existir.
+    """
+    tmp = origem
+    if origem.parent != destino.parent:
+        tmp = destino.with_name(f"{destino.stem}.{os.getpid()}.tmp{destino.suffix}")
+    try:
+        if tmp != origem:
+            shutil.copyfile(origem, tmp)
+        os.replace(tmp, destino)
+    except Exception:
+        for f in {tmp, origem}:
+            with contextlib.suppress(OSError):
+                f.unlink()
+        raise
+    if tmp != origem:
+        with contextlib.suppress(OSError):
+            origem.unlink()
+
+
+def _versao_codigo() -> str:
+    """Hash deste modulo (qualquer mudanca no codigo invalida as execucoes anteriores); sem o fonte, so VERSAO_REGRAS_PARSER."""
+    try:
+        return hashlib.sha1(Path(__file__).read_bytes()).hexdigest()[:12]
+    except OSError:
+        return ""
+
+
+def assinatura_execucao(arquivos: List[Path]) -> Dict:
+    """Entradas (caminho, tamanho, mtime), secoes do ini que afetam o resultado e versao do codigo/regras."""
+    config = {sec: dict(CFG.items(sec)) for sec in SECOES_MANIFESTO if CFG.has_section(sec)}
+    config["efetivo"] = [TOLERANCIA, SUGERIR_CORRESPONDENCIAS, JANELA_DIAS, MAX_CANDIDATOS]
+    entradas = []
+    for f in arquivos:
+        st = f.stat()
+        entradas.append([str(f), st.st_size, st.st_mtime_ns])
+    return {
+        "entradas": entradas,
+        "config": hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest(),
+        "versao": [VERSAO_REGRAS_PARSER, _versao_codigo(), *(LAYOUTS[t]["regras"] for t in sorted(LAYOUTS))],
+    }
+
+
+def _ler_manifesto_execucao(out_dir: Path) -> Dict[str, Dict]:
+    try:
+        dados = json.loads((out_dir / MANIFESTO_EXECUCAO).read_text(encoding="utf-8"))
+        return dados if isinstance(dados, dict) else {}
+    except Exception:
+        return {}
+
+
+def execucao_em_cache(fout: Path, assinatura: Dict) -> Optional[List]:
+    """Resumo da execucao anterior se a assinatura e a mesma e o Excel continua intacto (mesmo tamanho/mtime, zip valido)."""
+    anterior = _ler_manifesto_execucao(fout.parent).get(fout.name)
+    if not anterior or any(anterior.get(k) != v for k, v in assinatura.items()):
+        return None
+    try:
+        st = fout.stat()
+    except OSError:
+        return None
+    if [st.st_size, st.st_mtime_ns] != anterior.get("saida") or not zipfile.is_zipfile(fout):
+        return None
+    return anterior.get("resumo")
+
+
+def registrar_execucao(fout: Path, assinatura: Dict, resumo: List):
+    """Grava a execucao no manifesto da pasta de saida."""
+    try:
+        st = fout.stat()
+        # Rele antes de gravar: o manifesto guarda todos os meses da pasta.
+        dados = _ler_manifesto_execucao(fout.parent)
+        dados[fout.name] = dict(assinatura, saida=[st.st_size, st.st_mtime_ns], resumo=resumo)
+        texto = json.dumps(dados, indent=1, ensure_ascii=False, default=str)
+        _gravar_atomico(fout.parent / MANIFESTO_EXECUCAO, texto.encode("utf-8"))
+    except Exception as exc:
+        log(f"[AVISO] Falha ao gravar manifesto da execucao: {exc}")
+
+
+def _meta_estado(fout: Path) -> Path:
+    chave = hashlib.sha1(os.path.normcase(os.path.abspath(fout)).encode("utf-8")).hexdigest()[:16]
+    return ESTADO_CONCILIACAO_DIR / f"{chave}.json"
+
+
+def carregar_estado(fout: Path) -> Optional[Tuple[Dict, Dict[str, pd.DataFrame], pd.DataFrame]]:
+    """
+    Estado da ultima conciliacao de fout: (meta, notas agregadas por arquivo {chave do relatorio: tabela}, conciliacao).
+    None se nao houver ou estiver ilegivel (a execucao fica completa).
+    """
+    try:
+        meta = json.loads(_meta_estado(fout).read_text(encoding="utf-8"))
+        notas = pd.read_parquet(ESTADO_CONCILIACAO_DIR / meta["notas"])
+        conciliacao = pd.read_parquet(ESTADO_CONCILIACAO_DIR / meta["conciliacao"])
+    except FileNotFoundError:
+        return None
+    except ImportError:
+        return None
+    except Exception as exc:
+        log(f"[AVISO] Estado da conciliacao anterior ilegivel, refazendo tudo: {exc}")
+        return None
+    conciliacao["Status"] = pd.Categorical(conciliacao["Status"].astype(object), categories=STATUS_CATEGORIAS)
+    # So relatorios com notas: relatorio vazio (ou gravado vazio por versao anterior) e lido de novo.
+    por_arquivo = {}
+    for chave, parte in notas.groupby("Arquivo", observed=True, sort=False):
+        por_arquivo[str(chave)] = parte[COLUNAS_NOTAS].reset_index(drop=True)
+    return meta, por_arquivo, conciliacao
+
+
+def gravar_estado(fout: Path, meta: Dict, por_arquivo: Dict[str, pd.DataFrame], conciliacao: pd.DataFrame):
+    """
+    Grava o estado: tabelas com nome novo e o .json (_gravar_atomico) por ultimo, apontando para elas;
+    so entao apaga as tabelas da gravacao anterior. Leitura concorrente nunca mistura duas execucoes.
+    """
+    arq_meta = _meta_estado(fout)
+    versao = f"{arq_meta.stem}.{os.getpid()}.{time.time_ns()}"
+    meta = dict(meta, notas=f"{versao}.notas.parquet", conciliacao=f"{versao}.conciliacao.parquet")
+    novos = [ESTADO_CONCILIACAO_DIR / meta["notas"], ESTADO_CONCILIACAO_DIR / meta["conciliacao"]]
+    try:
+        ESTADO_CONCILIACAO_DIR.mkdir(parents=True, exist_ok=True)
+        notas = juntar_notas([df.assign(Arquivo=chave) for chave, df in por_arquivo.items()])
+        if "Arquivo" not in notas:
+            notas["Arquivo"] = pd.Series(dtype=object)
+        notas.astype({"Arquivo": "category"}).to_parquet(novos[0], index=False)
+        conciliacao.to_parquet(novos[1], index=False)
+        _gravar_atomico(arq_meta, json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+    except Exception as exc:
+        if not isinstance(exc, ImportError):
+            log(f"[AVISO] Estado da conciliacao nao foi gravado: {exc}")
+        for f in novos:
+            with contextlib.suppress(OSError):
+                f.unlink()
+        return
+    for antigo in ESTADO_CONCILIACAO_DIR.glob(f"{arq_meta.stem}.*.parquet"):
+        if antigo not in novos:
+            with contextlib.suppress(OSError):
+                antigo.unlink()
+
+
+# Limite de linhas de uma aba do Excel (.xlsx), cabecalho incluso
+LINHAS_MAX_EXCEL = 1_048_576
+DATA_BASE_EXCEL = pd.Timestamp("1899-12-30")
+LINHAS_POR_ESCRITA = 50_000
+
+
+def _valores_coluna(serie: pd.Series) -> Tuple[str, list]:
+    """
+    Converte a coluna de uma vez (NumPy -> lista Python) e escolhe o metodo de escrita do xlsxwriter.
+    Vazios (NaN/NaT/None/"") viram None e nao sao gravados. Datas vao como serial do Excel (numero + formato de data).
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        if getattr(serie.dt, "tz", None) is not None:
+            serie = serie.dt.tz_localize(None)
+        serial = ((serie - DATA_BASE_EXCEL) / pd.Timedelta(days=1)).to_numpy(dtype="float64", na_value=np.nan)
+        return "write_number", np.where(np.isfinite(serial), serial, None).tolist()
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        arr = serie.to_numpy(dtype="float64", na_value=np.nan)
+        return "write_number", np.where(np.isfinite(arr), arr, None).tolist()
+    valores = np.array(serie.astype(object).to_numpy(), dtype=object)
+    valores[pd.isna(valores) | (valores == "")] = None
+    if pd.api.types.is_string_dtype(serie) and all(v is None or isinstance(v, str) for v in valores):
+        return "write_string", valores.tolist()
+    return "write", valores.tolist()
+
+
+def gravar_tabela(
+    wb,
+    nome_aba: str,
+    df: pd.DataFrame,
+    formatos: Dict[str, Tuple[float, object]],
+    fmt_header,
+    condicionais: Optional[Dict[str, List[Dict]]] = None,
+    linhas_max: int = LINHAS_MAX_EXCEL,
+) -> list:
+    """
+    Grava df em aba(s) nova(s) de wb, linha a linha e em ordem (compativel com constant_memory).
+    formatos: coluna -> (largura, formato), aplicado a faixa da coluna e a cada celula gravada.
+    condicionais: coluna -> formatos condicionais, aplicados exatamente nas linhas gravadas.
+    Acima de linhas_max (cabecalho incluso) divide em abas "<nome> (2)", "<nome> (3)"...
+    """
+    nomes = df.columns.tolist()
+    fmts = [formatos.get(c, (None, None))[1] for c in nomes]
+    ultima_col = max(0, len(nomes) - 1)
+    por_aba = max(1, linhas_max - 1)
+    n = len(df)
+    inicios = range(0, n, por_aba) if n else [0]
+    if len(inicios) > 1:
+        log(f"[AVISO] {nome_aba}: {n} linhas, acima do limite do Excel; dividida em {len(inicios)} abas")
+
+    abas = []
+    for parte, ini in enumerate(inicios, start=1):
+        ws = wb.add_worksheet(nome_aba if parte == 1 else f"{nome_aba} ({parte})"[:31])
+        fim = min(n, ini + por_aba)
+        for c, nome in enumerate(nomes):
+            largura, fmt = formatos.get(nome, (None, None))
+            if largura is not None or fmt is not None:
+                ws.set_column(c, c, largura, fmt)
+        ws.set_row(0, 22)
+        for c, nome in enumerate(nomes):
+            ws.write_string(0, c, nome, fmt_header)
+        # Converte em fatias: so LINHAS_POR_ESCRITA linhas viram objetos Python de cada vez.
+        for bloco in range(ini, fim, LINHAS_POR_ESCRITA):
+            fatia = df.iloc[bloco : min(fim, bloco + LINHAS_POR_ESCRITA)]
+            colunas = [_valores_coluna(fatia[c]) for c in nomes]
+            metodos = [getattr(ws, metodo) for metodo, _ in colunas]
+            for r, linha in enumerate(zip(*(valores for _, valores in colunas)), start=bloco - ini + 1):
+                for c, v in enumerate(linha):
+                    if v is not None:
+                        metodos[c](r, c, v, fmts[c])
+        ws.freeze_panes(1, 0)
+        ws.autofilter(0, 0, fim - ini, ultima_col)
+        if fim > ini:
+            for nome, regras in (condicionais or {}).items():
+                if nome in nomes:
+                    c = nomes.index(nome)
+                    for regra in regras:
+                        ws.conditional_format(1, c, fim - ini, c, regra)
+        abas.append(ws)
+    return abas
+
+
+def processar_empresa(
+    empresa: str,
+    pasta_base: str,
+    mes_ano: str,
+    arquivo_dom: Optional[str] = None,
+    arquivo_emp: Optional[str] = None,
+    usar_cache: bool = True,
+    processos_leitura: Optional[int] = None,
+    forcar: bool = False,
+) -> Optional[Path]:
+    """
+    Gera a conciliacao de uma empresa. Retorna o caminho do Excel gerado, ou None se pulou/falhou.
+    Sem forcar (nem usar_cache=False), devolve o Excel anterior se entradas, config e versao nao mudaram.
+    """
     log(f"Empresa: {empresa}")
+    inicio_descoberta = time.perf_counter()
     # Calcula caminho da pasta que contem os relatorios para a empresa.
     # Se SUBPASTA_RELATORIO tiver placeholder {empresa}, usa diretamente.
     # Caso contrario, adiciona "RELATORIO RPA - {empresa}" ao final.
@@ -431,63 +2257,60 @@ def processar_empresa(empresa: str, pasta_base: str, mes_ano: str, arquivo_dom:
         if "{empresa}" not in SUBPASTA_RELATORIO and "RELATORIO RPA" not in sub_rel_path.name.upper():
             sub_rel_path = sub_rel_path / f"RELATORIO RPA - {empresa}"
 
+    chamadas_inicio = _CHAMADAS_FS
     base_path = Path(pasta_base)
-    if (base_path / empresa).exists():
-        base_path = base_path / empresa
+    indice_base = _listar_pasta(base_path)
+    if indice_base and empresa.lower() in indice_base["pastas"]:
+        base_path = indice_base["pastas"][empresa.lower()]
     path_rpa = base_path / sub_rel_path
 
-    if not path_rpa.exists():
+    indice_rpa = _listar_pasta(path_rpa)
+    if indice_rpa is None:
         log("[PULADO] Pasta nao encontrada.")
         return
 
-    # Garante pasta XLSX para conversoes.
     xlsx_dir = path_rpa / "XLSX"
-    xlsx_dir.mkdir(exist_ok=True)
-
     dom_candidates = []
     emp_candidates = []
 
     def tentar_adicionar_por_nome(arq_nome: Optional[str], destino: list):
         if not arq_nome:
             return
-        alvo = path_rpa / arq_nome
-        if alvo.exists():
-            destino.append(alvo)
-        else:
-            # tenta procurar por nome exato dentro da pasta (qualquer subpasta direta)
-            for f in path_rpa.glob("**/*"):
-                if f.is_file() and f.name.lower() == arq_nome.lower():
-                    destino.append(f)
-                    break
+        # Nome exato na pasta; senao procura em qualquer subpasta.
+        encontrado = indice_rpa["arquivos"].get(arq_nome.lower()) or _procurar_por_nome(path_rpa, arq_nome)
+        if encontrado:
+            destino.append(encontrado)
 
     tentar_adicionar_por_nome(arquivo_dom, dom_candidates)
     tentar_adicionar_por_nome(arquivo_emp, emp_candidates)
 
     # Se nao achar pelos nomes especificos, recorre ao padrao por keyword
-    for f in path_rpa.iterdir():
-        if f.name.startswith("~$"):
-            continue
-        up = f.name.upper()
-        if KEYWORD_DOMINIO in up and f.suffix.lower() in (".xls", ".xlsx"):
+    for f in indice_rpa["por_keyword"][KEYWORD_DOMINIO]:
+        if f.suffix.lower() in (".xls", ".xlsx"):
             dom_candidates.append(f)
-        if KEYWORD_EMPRESA in up and f.suffix.lower() in (".xls", ".xlsx"):
+    for f in indice_rpa["por_keyword"][KEYWORD_EMPRESA]:
+        if f.suffix.lower() in (".xls", ".xlsx"):
             emp_candidates.append(f)
-    xlsx_dir = path_rpa / "XLSX"
-    if xlsx_dir.exists():
-        for f in xlsx_dir.iterdir():
-            if f.name.startswith("~$"):
-                continue
-            up = f.name.upper()
-            if KEYWORD_DOMINIO in up and f.suffix.lower() == ".xlsx":
+    indice_xlsx = _listar_pasta(xlsx_dir)
+    if indice_xlsx:
+        # Conversao cujo .xls saiu da pasta nao e entrada: limpar_cache_conversoes apaga o XLSX mais abaixo.
+        orfas = {nome.lower() for nome in conversoes_orfas(xlsx_dir, set(indice_rpa["arquivos"])).values()}
+        for f in indice_xlsx["por_keyword"][KEYWORD_DOMINIO]:
+            if f.suffix.lower() == ".xlsx" and f.name.lower() not in orfas:
                 dom_candidates.append(f)
-            if KEYWORD_EMPRESA in up and f.suffix.lower() == ".xlsx":
+        for f in indice_xlsx["por_keyword"][KEYWORD_EMPRESA]:
+            if f.suffix.lower() == ".xlsx" and f.name.lower() not in orfas:
                 emp_candidates.append(f)
+    log(f"Busca de arquivos: {_CHAMADAS_FS - chamadas_inicio} leitura(s) de pasta no disco ({len(_INDICE_PASTAS)} pasta(s) no indice)")
 
     def escolher_arquivos(files):
         escolhidos = {}
         for f in files:
             stem = f.stem.lower()
             if stem in escolhidos:
+                # XLSX/<stem>.xlsx e a conversao do .xls: o .xls fica, e o cache de conversao decide se ela ainda vale.
+                if f.parent == xlsx_dir and escolhidos[stem].suffix.lower() == ".xls":
+                    continue
                 if f.suffix.lower() == ".xlsx":
                     escolhidos[stem] = f
             else:
@@ -503,56 +2326,205 @@ def processar_empresa(empresa: str, pasta_base: str, mes_ano: str, arquivo_dom:
 
     dom_files = sorted(dom_files)
     emp_files = sorted(emp_files)
+    registrar_etapa("descoberta", time.perf_counter() - inicio_descoberta, linhas_saida=len(dom_files) + len(emp_files))
 
-    dfs_dom = []
-    for f in dom_files:
-        log(f"Lendo DOMINIO: {f.name}")
-        dfs_dom.append(preparar_dataframe(ler_arquivo(f), "DOMINIO"))
-    dfs_emp = []
-    for f in emp_files:
-        log(f"Lendo EMPRESA: {f.name}")
-        dfs_emp.append(preparar_dataframe(ler_arquivo(f), "EMPRESA"))
+    # Saida agora na pasta da empresa: .../RELATORIO RPA - <empresa>/Conciliacao
+    out_dir = path_rpa / "Conciliacao"
+    fout = out_dir / f"Conciliacao_{empresa.replace(' ', '_')}_{mes_ano}.xlsx"
+    # Assinatura tirada dos arquivos da rede antes de qualquer leitura: se mudarem durante a execucao, a proxima refaz.
+    try:
+        assinatura = assinatura_execucao(dom_files + emp_files)
+    except OSError as exc:
+        log(f"[AVISO] Sem manifesto da execucao: {exc}")
+        assinatura = None
+    resumo_anterior = None if forcar or not usar_cache or assinatura is None else execucao_em_cache(fout, assinatura)
+    if resumo_anterior is not None:
+        log("Entradas, config e versao iguais as da ultima execucao: Excel reaproveitado")
+        for item, valor in resumo_anterior:
+            log(f"  {item}: {valor}")
+        log(f"Consolidado mantido: {fout}")
+        return fout
+
+    # Staging: trabalha sobre uma copia local da pasta (so os arquivos que mudaram sao copiados da rede).
+    pasta_trabalho = path_rpa
+    if STAGING_LOCAL:
+        try:
+            pasta_local = _pasta_staging(path_rpa)
+            locais, copiados = espelhar_arquivos(dom_files + emp_files, path_rpa, pasta_local)
+            dom_files, emp_files = locais[: len(dom_files)], locais[len(dom_files) :]
+            pasta_trabalho = pasta_local
+            log(f"Staging local: {copiados} de {len(locais)} arquivo(s) copiado(s) para {pasta_local}")
+        except OSError as exc:
+            log(f"[AVISO] Staging local indisponivel, lendo direto da pasta de rede: {exc}")
+
+    # Garante pasta XLSX para conversoes e descarta conversoes de .xls que nao existem mais.
+    xlsx_trabalho = pasta_trabalho / "XLSX"
+    if pasta_trabalho != path_rpa or "xlsx" not in indice_rpa["pastas"]:
+        xlsx_trabalho.mkdir(parents=True, exist_ok=True)
+    limpar_cache_conversoes(xlsx_trabalho, existentes=set(indice_rpa["arquivos"]))
+
+    # Estado da execucao anterior: relatorio com a mesma chave do cache (caminho, tamanho, mtime, regras) nao e lido
+    # de novo, as notas agregadas dele vem do estado. So entram na leitura os relatorios novos ou alterados.
+    estado = carregar_estado(fout) if usar_cache and not forcar else None
+    anteriores = estado[1] if estado else {}
+    tarefas = [(f, "DOMINIO") for f in dom_files] + [(f, "EMPRESA") for f in emp_files]
+    chaves: List[Optional[str]] = []
+    for f, tipo in tarefas:
+        try:
+            chaves.append(_chave_cache_relatorio(f, tipo))
+        except OSError:
+            chaves.append(None)
+    agregados = [anteriores.get(c) if c else None for c in chaves]
+    ler = [i for i, agg in enumerate(agregados) if agg is None]
+    # LibreOffice como primeiro motor de .xls: converte de uma vez os .xls que vao ser lidos (sem relatorio em cache),
+    # em lotes por perfil, em vez de uma partida a frio do soffice por arquivo. A leitura depois acha a conversao pronta.
+    if MOTORES_XLS[:1] == ["libreoffice"]:
+        converter_lote(
+            [
+                tarefas[i][0]
+                for i in ler
+                if tarefas[i][0].suffix.lower() == ".xls"
+                and not (usar_cache and chaves[i] and (CACHE_RELATORIOS_DIR / f"{chaves[i]}.parquet").exists())
+            ]
+        )
+    # DOMINIO e EMPRESA (quinzenas) sao independentes: leitura em paralelo, resultado na ordem acima.
+    resultados = carregar_relatorios([tarefas[i] for i in ler], usar_cache=usar_cache, processos=processos_leitura)
+    falhas = 0
+    for i, df in zip(ler, resultados):
+        if df is None:
+            falhas += 1
+        else:
+            agregados[i] = agregar_por_nota(df)
+    if estado:
+        log(f"Conciliacao incremental: {len(tarefas) - len(ler)} relatorio(s) do estado anterior, {len(ler)} lido(s)")
+    # Relatorio que falhou ou veio sem notas fica fora do estado: a proxima execucao le de novo.
+    por_arquivo = {c: agg for c, agg in zip(chaves, agregados) if c and agg is not None and not agg.empty}
 
-    df_d = pd.concat([d for d in dfs_dom if d is not None], ignore_index=True) if dfs_dom else pd.DataFrame()
-    df_e = pd.concat([e for e in dfs_emp if e is not None], ignore_index=True) if dfs_emp else pd.DataFrame()
+    # Notas agregadas por relatorio, agregadas de novo na ordem dos arquivos (soma, menor data, primeiro nao vazio).
+    df_d_g = agregar_por_nota(juntar_notas(agregados[: len(dom_files)]))
+    df_e_g_full = agregar_por_nota(juntar_notas(agregados[len(dom_files) :]))
 
-    if df_d.empty and df_e.empty:
+    if df_d_g.empty and df_e_g_full.empty:
         log("[ERRO] Dados insuficientes.")
         return
 
-    def agregar_por_nota(df: pd.DataFrame) -> pd.DataFrame:
-        if df is None or df.empty:
-            return pd.DataFrame(columns=["Codigo", "Nota", "Valor", "Data", "Status_NFE"])
-        out = df.copy()
-        for c in ["Codigo", "Nota", "Valor", "Data", "Status_NFE"]:
-            if c not in out.columns:
-                out[c] = ""
-
-        def first_non_empty(series: pd.Series):
-            for v in series:
-                if pd.notna(v) and str(v).strip() != "":
-                    return v
-            return ""
+    os.makedirs(out_dir, exist_ok=True)
+    # Grava num temporario (no staging, local) e so publica pronto: nao fica planilha pela metade na pasta de saida.
+    pasta_tmp = pasta_trabalho / "Conciliacao"
+    pasta_tmp.mkdir(parents=True, exist_ok=True)
+    fout_tmp = pasta_tmp / f"{fout.stem}.{os.getpid()}.tmp.xlsx"
 
-        grouped = (
-            out.groupby("Nota", as_index=False)
-            .agg(
-                Valor=("Valor", "sum"),
-                Data=("Data", "min"),
-                Codigo=("Codigo", first_non_empty),
-                Status_NFE=("Status_NFE", first_non_empty),
+    try:
+        # A mesma Nota pode aparecer múltiplas vezes (ex.: por CFOP). Conciliação é feita por Nota,
+        # somando os valores para obter o total por documento.
+        log(f"Notas únicas (Dom/Emp): {len(df_d_g)} / {len(df_e_g_full)}")
+
+        # Se a empresa tem Status NFE, separa notas inutilizadas (ex.: "I") em aba dedicada.
+        mask_inut = mascara_inutilizadas(df_e_g_full)
+        df_inutilizadas = df_e_g_full.loc[mask_inut]
+        if mask_inut.any():
+            log(f"Notas inutilizadas (empresa): {len(df_inutilizadas)}")
+
+        df_mudancas = None
+        if estado is None:
+            df_final = conciliar_notas(df_d_g, df_e_g_full)
+        else:
+            meta, _, anterior = estado
+            mesma_regra = assinatura is not None and all(meta.get(k) == assinatura[k] for k in ("config", "versao"))
+            if mesma_regra:
+                # Afetadas: notas dos relatorios que entraram, mudaram ou sairam desde a execucao anterior.
+                trocados = [anteriores[c] for c in anteriores.keys() - por_arquivo.keys()]
+                trocados += [por_arquivo[c] for c in por_arquivo.keys() - anteriores.keys()]
+                afetadas = np.unique(np.concatenate([np.zeros(0, dtype="int64")] + [t["Nota"].to_numpy() for t in trocados]))
+                df_final = atualizar_conciliacao(anterior, df_d_g, df_e_g_full, afetadas)
+                log(f"Notas recalculadas: {len(afetadas)} de {len(df_final)}")
+            else:
+                # Config ou versao mudou: recalcula tudo, mas ainda compara com o status anterior.
+                df_final = conciliar_notas(df_d_g, df_e_g_full)
+                afetadas = np.union1d(anterior["Nota"].to_numpy(), df_final["Nota"].to_numpy())
+            df_mudancas = status_alterado(anterior, df_final, afetadas)
+            log(f"Notas com status alterado desde a execucao anterior: {len(df_mudancas)}")
+
+        df_pares = pd.DataFrame()
+        if SUGERIR_CORRESPONDENCIAS:
+            notas_so_dom = df_final.loc[df_final["Status"] == "So Dominio", "Nota"].to_numpy()
+            notas_so_emp = df_final.loc[df_final["Status"] == "So Empresa", "Nota"].to_numpy()
+            df_pares = sugerir_correspondencias(
+                df_d_g.iloc[np.searchsorted(df_d_g["Nota"].to_numpy(), notas_so_dom)],
+                df_e_g_full.iloc[np.searchsorted(df_e_g_full["Nota"].to_numpy(), notas_so_emp)],
             )
+            log(f"Possiveis correspondencias: {len(df_pares)} par(es) entre So Dominio e So Empresa")
+
+        # Aba de resumo para leitura rápida
+        total_resultado = len(df_final)
+        por_status = df_final["Status"].value_counts()
+        qtd_inutilizadas = int(por_status.get("Inutilizada", 0))
+        qtd_so_empresa = int(por_status.get("So Empresa", 0))
+        qtd_so_dominio = int(por_status.get("So Dominio", 0))
+        qtd_ok = int(por_status.get("OK", 0))
+        qtd_div = int(por_status.get("Divergencia Valor", 0))
+
+        df_resumo = pd.DataFrame(
+            [
+                ["Empresa", empresa],
+                ["Mes/Ano", mes_ano],
+                ["Notas (Conciliacao Completa)", total_resultado],
+                ["Inutilizadas", qtd_inutilizadas],
+                ["So Empresa", qtd_so_empresa],
+                ["So Dominio", qtd_so_dominio],
+                ["OK", qtd_ok],
+                ["Divergencia Valor", qtd_div],
+                ["Notas lidas (Dom/Emp)", f"{total_resultado - qtd_so_empresa - qtd_inutilizadas} / {len(df_e_g_full)}"],
+            ],
+            columns=["Item", "Valor"],
         )
-        return grouped[["Codigo", "Nota", "Valor", "Data", "Status_NFE"]]
-
-    # Saida agora na pasta da empresa: .../RELATORIO RPA - <empresa>/Conciliacao
-    out_dir = path_rpa / "Conciliacao"
-    os.makedirs(out_dir, exist_ok=True)
-    fout = out_dir / f"Conciliacao_{empresa.replace(' ', '_')}_{mes_ano}.xlsx"
+        if SUGERIR_CORRESPONDENCIAS:
+            df_resumo.loc[len(df_resumo)] = ["Possiveis correspondencias", len(df_pares)]
+        if df_mudancas is not None:
+            df_resumo.loc[len(df_resumo)] = ["Status alterado (execucao anterior)", len(df_mudancas)]
+
+        # Fronteira da exportacao: Nota volta a texto e centavos a reais.
+        df_saida = pd.DataFrame(
+            {
+                "Codigo": df_final["Codigo"],
+                "Nota": df_final["Nota"].astype(str),
+                "Valor_Dom": df_final["Centavos_Dom"] / 100,
+                "Valor_Emp": df_final["Centavos_Emp"] / 100,
+                "Diferenca": df_final["Diferenca"] / 100,
+                "Status": df_final["Status"],
+            }
+        )
+        df_pares_out = pd.DataFrame()
+        if not df_pares.empty:
+            df_pares_out = pd.DataFrame(
+                {
+                    "Nota_Dom": df_pares["Nota_Dom"].astype(str),
+                    "Nota_Emp": df_pares["Nota_Emp"].astype(str),
+                    "Data_Dom": df_pares["Data_Dom"],
+                    "Data_Emp": df_pares["Data_Emp"],
+                    "Valor_Dom": df_pares["Centavos_Dom"] / 100,
+                    "Valor_Emp": df_pares["Centavos_Emp"] / 100,
+                    "Diferenca": (df_pares["Centavos_Dom"] - df_pares["Centavos_Emp"]) / 100,
+                }
+            )
+        df_mudancas_out = pd.DataFrame()
+        if df_mudancas is not None and not df_mudancas.empty:
+            df_mudancas_out = df_mudancas.assign(Nota=df_mudancas["Nota"].astype(str))
+        df_inut_out = pd.DataFrame()
+        if not df_inutilizadas.empty:
+            df_inut_out = pd.DataFrame(
+                {
+                    "Codigo": df_inutilizadas["Codigo"],
+                    "Nota": df_inutilizadas["Nota"].astype(str),
+                    "Data": df_inutilizadas["Data"],
+                    "Valor": df_inutilizadas["Centavos"] / 100,
+                    "Status_NFE": df_inutilizadas["Status_NFE"],
+                }
+            )
 
-    try:
-        with pd.ExcelWriter(fout, engine="xlsxwriter") as writer:
-            wb = writer.book
+        # constant_memory: cada linha vai direto para o XML da aba, sem manter a planilha inteira em memoria.
+        inicio_escrita = time.perf_counter()
+        with xlsxwriter.Workbook(str(fout_tmp), {"constant_memory": True}) as wb:
             fmt_header = wb.add_format(
                 {
                     "bold": True,
@@ -571,152 +2543,245 @@ def processar_empresa(empresa: str, pasta_base: str, mes_ano: str, arquivo_dom:
             fmt_b = wb.add_format({"bg_color": "#BDD7EE", "font_color": "#000000", "align": "center", "valign": "vcenter"})
 
             # Ordem das abas: Resumo -> Conciliacao Completa -> Inutilizadas
-            ws_r = wb.add_worksheet("Resumo")
-            ws = wb.add_worksheet("Conciliacao Completa")
-            writer.sheets["Resumo"] = ws_r
-            writer.sheets["Conciliacao Completa"] = ws
-            # A mesma Nota pode aparecer múltiplas vezes (ex.: por CFOP). Conciliação é feita por Nota,
-            # somando os valores para obter o total por documento.
-            df_d_g = agregar_por_nota(df_d) if not df_d.empty else pd.DataFrame(columns=["Codigo", "Nota", "Valor", "Data", "Status_NFE"])
-            df_e_g_full = agregar_por_nota(df_e) if not df_e.empty else pd.DataFrame(columns=["Codigo", "Nota", "Valor", "Data", "Status_NFE"])
-            log(f"Notas únicas (Dom/Emp): {len(df_d_g)} / {len(df_e_g_full)}")
-
-            # Se a empresa tem Status NFE, separa notas inutilizadas (ex.: "I") em aba dedicada.
-            df_inutilizadas = pd.DataFrame()
-            df_e_g_all = df_e_g_full.copy()
-            df_e_g = df_e_g_full.copy()
-            if "Status_NFE" in df_e_g.columns and not df_e_g.empty:
-                status_norm = df_e_g["Status_NFE"].astype(str).str.strip().str.upper()
-                mask_inut = status_norm.eq("I") | status_norm.str.startswith("I ")
-                if mask_inut.any():
-                    df_inutilizadas = df_e_g.loc[mask_inut].copy()
-                    df_e_g = df_e_g.loc[~mask_inut].copy()
-
-                    notas_inut = set(df_inutilizadas["Nota"].astype(str))
-                    if "Nota" in df_d_g.columns and not df_d_g.empty:
-                        df_d_g = df_d_g.loc[~df_d_g["Nota"].astype(str).isin(notas_inut)].copy()
-                    log(f"Notas inutilizadas (empresa): {len(df_inutilizadas)}")
-
-            df_final = pd.merge(df_d_g, df_e_g, on="Nota", how="outer", suffixes=("_Dom", "_Emp"), indicator=True)
-            df_final["Valor_Dom"] = df_final["Valor_Dom"].fillna(0.0)
-            df_final["Valor_Emp"] = df_final["Valor_Emp"].fillna(0.0)
-            df_final["Codigo"] = df_final.get("Codigo_Dom", pd.Series()).fillna(df_final.get("Codigo_Emp", ""))
-            df_final["Diferenca"] = df_final["Valor_Dom"] - df_final["Valor_Emp"]
-            df_final["Status"] = df_final.apply(
-                lambda r: "So Dominio"
-                if r["_merge"] == "left_only"
-                else ("So Empresa" if r["_merge"] == "right_only" else ("Divergencia Valor" if abs(r["Diferenca"]) > 0.05 else "OK")),
-                axis=1,
-            )
+            gravar_tabela(wb, "Resumo", df_resumo, {"Item": (28, fmt_text), "Valor": (40, fmt_text)}, fmt_header)
 
-            cols_finais = ["Codigo", "Nota", "Valor_Dom", "Valor_Emp", "Diferenca", "Status"]
-            df_final = df_final[[c for c in cols_finais if c in df_final.columns]]
+            # Aba principal (conciliacao completa)
+            destaque_status = [
+                {"type": "text", "criteria": "containing", "value": "Divergencia", "format": fmt_r},
+                {"type": "text", "criteria": "containing", "value": "So Dominio", "format": fmt_y},
+                {"type": "text", "criteria": "containing", "value": "So Empresa", "format": fmt_b},
+                {"type": "text", "criteria": "containing", "value": "Inutilizada", "format": fmt_b},
+            ]
+            gravar_tabela(
+                wb,
+                "Conciliacao Completa",
+                df_saida,
+                {
+                    "Codigo": (14, fmt_text),
+                    "Nota": (12, fmt_text),
+                    "Valor_Dom": (18, fmt_m),
+                    "Valor_Emp": (18, fmt_m),
+                    "Diferenca": (18, fmt_m),
+                    "Status": (22, fmt_text),
+                },
+                fmt_header,
+                condicionais={"Status": destaque_status},
+            )
 
-            # Reinsere inutilizadas no Resultado com status próprio (para não aparecer como "So Empresa")
-            if not df_inutilizadas.empty:
-                n_inut = len(df_inutilizadas)
-                cod_inut = df_inutilizadas["Codigo"] if "Codigo" in df_inutilizadas.columns else pd.Series([""] * n_inut)
-                nota_inut = df_inutilizadas["Nota"] if "Nota" in df_inutilizadas.columns else pd.Series([""] * n_inut)
-                val_inut = df_inutilizadas["Valor"] if "Valor" in df_inutilizadas.columns else pd.Series([0.0] * n_inut)
-                df_inut_res = pd.DataFrame(
+            if not df_inut_out.empty:
+                gravar_tabela(
+                    wb,
+                    "Inutilizadas",
+                    df_inut_out,
                     {
-                        "Codigo": cod_inut,
-                        "Nota": nota_inut,
-                        "Valor_Dom": 0.0,
-                        "Valor_Emp": val_inut,
-                        "Diferenca": 0.0 - val_inut,
-                        "Status": "Inutilizada",
-                    }
+                        "Codigo": (14, fmt_text),
+                        "Nota": (12, fmt_text),
+                        "Data": (14, fmt_date),
+                        "Valor": (18, fmt_m),
+                        "Status_NFE": (12, fmt_text),
+                    },
+                    fmt_header,
                 )
-                df_final = pd.concat([df_final, df_inut_res], ignore_index=True)
 
-            try:
-                df_final["k"] = pd.to_numeric(df_final["Nota"])
-                df_final.sort_values("k", inplace=True)
-                df_final.drop(columns="k", inplace=True)
-            except Exception:
-                df_final.sort_values("Nota", inplace=True)
-
-            # Aba de resumo para leitura rápida
-            total_resultado = len(df_final)
-            qtd_inutilizadas = int((df_final["Status"] == "Inutilizada").sum()) if "Status" in df_final.columns else 0
-            qtd_so_empresa = int((df_final["Status"] == "So Empresa").sum()) if "Status" in df_final.columns else 0
-            qtd_so_dominio = int((df_final["Status"] == "So Dominio").sum()) if "Status" in df_final.columns else 0
-            qtd_ok = int((df_final["Status"] == "OK").sum()) if "Status" in df_final.columns else 0
-            qtd_div = int((df_final["Status"] == "Divergencia Valor").sum()) if "Status" in df_final.columns else 0
-
-            df_resumo = pd.DataFrame(
-                [
-                    ["Empresa", empresa],
-                    ["Mes/Ano", mes_ano],
-                    ["Notas (Conciliacao Completa)", total_resultado],
-                    ["Inutilizadas", qtd_inutilizadas],
-                    ["So Empresa", qtd_so_empresa],
-                    ["So Dominio", qtd_so_dominio],
-                    ["OK", qtd_ok],
-                    ["Divergencia Valor", qtd_div],
-                    ["Notas lidas (Dom/Emp)", f"{len(df_d_g)} / {len(df_e_g_all)}"],
-                ],
-                columns=["Item", "Valor"],
-            )
-            df_resumo.to_excel(writer, index=False, sheet_name="Resumo")
-            ws_r.set_row(0, 22)
-            ws_r.write(0, 0, "Item", fmt_header)
-            ws_r.write(0, 1, "Valor", fmt_header)
-            ws_r.freeze_panes(1, 0)
-            ws_r.autofilter(0, 0, max(0, len(df_resumo)), 1)
-            ws_r.set_column("A:A", 28, fmt_text)
-            ws_r.set_column("B:B", 40, fmt_text)
+            # Pares So Dominio x So Empresa com valor e data proximos, para conferencia do analista
+            if not df_pares_out.empty:
+                gravar_tabela(
+                    wb,
+                    "Possivel Correspondencia",
+                    df_pares_out,
+                    {
+                        "Nota_Dom": (12, fmt_text),
+                        "Nota_Emp": (12, fmt_text),
+                        "Data_Dom": (14, fmt_date),
+                        "Data_Emp": (14, fmt_date),
+                        "Valor_Dom": (18, fmt_m),
+                        "Valor_Emp": (18, fmt_m),
+                        "Diferenca": (18, fmt_m),
+                    },
+                    fmt_header,
+                )
 
-            # Aba principal (conciliacao completa)
-            df_final.to_excel(writer, index=False, sheet_name="Conciliacao Completa")
-            ws.set_row(0, 22)
-            for col_idx, col_name in enumerate(df_final.columns.tolist()):
-                ws.write(0, col_idx, col_name, fmt_header)
-            ws.freeze_panes(1, 0)
-            ws.autofilter(0, 0, max(0, len(df_final)), max(0, len(df_final.columns) - 1))
-
-            ws.set_column("A:A", 14, fmt_text)
-            ws.set_column("B:B", 12, fmt_text)
-            ws.set_column("C:E", 18, fmt_m)
-            ws.set_column("F:F", 22, fmt_text)
-            ws.conditional_format("F2:F9999", {"type": "text", "criteria": "containing", "value": "Divergencia", "format": fmt_r})
-            ws.conditional_format("F2:F9999", {"type": "text", "criteria": "containing", "value": "So Dominio", "format": fmt_y})
-            ws.conditional_format("F2:F9999", {"type": "text", "criteria": "containing", "value": "So Empresa", "format": fmt_b})
-            ws.conditional_format("F2:F9999", {"type": "text", "criteria": "containing", "value": "Inutilizada", "format": fmt_b})
-
-            if not df_inutilizadas.empty:
-                ws2 = wb.add_worksheet("Inutilizadas")
-                writer.sheets["Inutilizadas"] = ws2
-                cols_inut = ["Codigo", "Nota", "Data", "Valor", "Status_NFE"]
-                df_inut_out = df_inutilizadas[[c for c in cols_inut if c in df_inutilizadas.columns]].copy()
-                try:
-                    df_inut_out["k"] = pd.to_numeric(df_inut_out["Nota"], errors="coerce")
-                    df_inut_out.sort_values("k", inplace=True)
-                    df_inut_out.drop(columns="k", inplace=True)
-                except Exception:
-                    pass
-                df_inut_out.to_excel(writer, index=False, sheet_name="Inutilizadas")
-                ws2.set_row(0, 22)
-                for col_idx, col_name in enumerate(df_inut_out.columns.tolist()):
-                    ws2.write(0, col_idx, col_name, fmt_header)
-                ws2.freeze_panes(1, 0)
-                ws2.autofilter(0, 0, max(0, len(df_inut_out)), max(0, len(df_inut_out.columns) - 1))
-                ws2.set_column("A:A", 14, fmt_text)
-                ws2.set_column("B:B", 12, fmt_text)
-                ws2.set_column("C:C", 14, fmt_date)
-                ws2.set_column("D:D", 18, fmt_m)
-                ws2.set_column("E:E", 12, fmt_text)
+            # Notas cujo status mudou desde a execucao anterior (ex.: chegada do relatorio da segunda quinzena)
+            if not df_mudancas_out.empty:
+                gravar_tabela(
+                    wb,
+                    "Status Alterado",
+                    df_mudancas_out,
+                    {"Nota": (12, fmt_text), "Status_Anterior": (22, fmt_text), "Status_Atual": (22, fmt_text)},
+                    fmt_header,
+                )
 
+        publicar_arquivo(fout_tmp, fout)
+        registrar_etapa(
+            "escrita",
+            time.perf_counter() - inicio_escrita,
+            linhas_entrada=len(df_saida) + len(df_inut_out) + len(df_pares_out) + len(df_mudancas_out),
+            num_bytes=fout.stat().st_size,
+        )
+        # Relatorio que nenhum motor leu (ex.: rede fora): o Excel sai, mas a proxima execucao refaz tudo.
+        if falhas:
+            log(f"[AVISO] {falhas} relatorio(s) nao lido(s): execucao nao registrada, a proxima refaz a conciliacao")
+        elif assinatura is not None:
+            registrar_execucao(fout, assinatura, df_resumo.values.tolist())
+            gravar_estado(fout, {"config": assinatura["config"], "versao": assinatura["versao"]}, por_arquivo, df_final)
         log(f"Consolidado salvo: {fout}")
+        return fout
     except Exception as exc:
         log(f"[ERRO SALVAR] {exc}")
+        with contextlib.suppress(OSError):
+            fout_tmp.unlink()
+        return None
 
 
-def run_conciliacao(mes_ano: str, empresas: List[str]):
-    log(f"Iniciando conciliacao [{mes_ano}]")
+def _executar_empresa(params: Dict) -> Tuple[Optional[Path], str, Dict]:
+    """
+    Roda processar_empresa guardando a ultima mensagem de erro/pulo, usada no resumo final.
+    Retorna tambem o registro de metricas da execucao (gravado em ARQUIVO_METRICAS se METRICAS).
+    """
+    ultimo_erro = [""]
+    anterior = LOG_FN
+
+    def registrar(msg: str):
+        if msg.startswith(("[ERRO", "[PULADO")):
+            ultimo_erro[0] = msg
+        if anterior:
+            anterior(msg)
+
+    _METRICAS.clear()
+    _PILHA_ETAPAS.clear()
+    inicio = time.time()
+    set_logger(registrar)
+    try:
+        saida = processar_empresa(**params)
+    except Exception as exc:
+        log(f"[ERRO] {exc}")
+        saida = None
+    finally:
+        set_logger(anterior)
+    registro = {
+        "empresa": params["empresa"],
+        "mes_ano": params["mes_ano"],
+        "inicio": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(inicio)),
+        "total_s": round(time.time() - inicio, 3),
+        "situacao": _situacao((saida, ultimo_erro[0])),
+        "versao": [VERSAO_REGRAS_PARSER, _versao_codigo()],
+        "etapas": {nome: dict(m, s=round(m["s"], 4)) for nome, m in _METRICAS.items()},
+    }
+    if METRICAS:
+        gravar_metricas(registro)
+    return saida, ultimo_erro[0], registro
+
+
+def gravar_metricas(registro: Dict):
+    """Acrescenta o registro como uma linha JSON (uma unica escrita: linhas de processos diferentes nao se misturam)."""
+    try:
+        ARQUIVO_METRICAS.parent.mkdir(parents=True, exist_ok=True)
+        with open(ARQUIVO_METRICAS, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(registro, ensure_ascii=False) + "\n")
+    except OSError as exc:
+        log(f"[AVISO] Metricas nao gravadas: {exc}")
+
+
+def resumo_metricas(registros: List[Dict]):
+    """Loga a tabela das etapas somadas em todos os registros: tempo, % do total, chamadas, linhas e MB."""
+    total: Dict[str, Dict[str, float]] = {}
+    for reg in registros:
+        for nome, m in reg.get("etapas", {}).items():
+            atual = total.setdefault(nome, dict.fromkeys(m, 0))
+            for k, v in m.items():
+                atual[k] += v
+    soma = sum(m["s"] for m in total.values()) or 1.0
+    log(f"Metricas por etapa ({len(registros)} execucao(oes)):")
+    log(f"  {'Etapa':<14}{'Tempo (s)':>11}{'%':>7}{'Chamadas':>10}{'Linhas ent.':>13}{'Linhas sai.':>13}{'MB':>9}")
+    for nome in [e for e in ETAPAS if e in total] + [e for e in total if e not in ETAPAS]:
+        m = total[nome]
+        log(
+            f"  {nome:<14}{m['s']:>11.2f}{100 * m['s'] / soma:>7.1f}{int(m['chamadas']):>10}"
+            f"{int(m['linhas_entrada']):>13}{int(m['linhas_saida']):>13}{m['bytes'] / 2**20:>9.1f}"
+        )
+
+
+_FILA_LOG = None
+
 
+def _inicializar_worker_empresa(fila_perfis, fila_log):
+    global _FILA_LOG
+    _inicializar_worker(fila_perfis)
+    _FILA_LOG = fila_log
+
+
+def _processar_empresa_isolada(params: Dict, tag: str) -> Tuple[Optional[Path], str, Dict]:
+    """Executa uma empresa num processo do pool; o log vai para a fila do processo principal marcado com a tag."""
+    set_logger(lambda msg: _FILA_LOG.put(f"[{tag}] {msg}"))
+    # O worker atende varias tarefas (empresas/meses): indice de pastas novo a cada uma.
+    limpar_indice_pastas()
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        return _executar_empresa(params)
+
+
+def _drenar_fila_log(fila):
+    while True:
+        try:
+            msg = fila.get_nowait()
+        except Exception:
+            return
+        log(msg)
+
+
+def _processar_em_paralelo(tarefas: List[Dict], jobs: int, tags: List[str]) -> List[Tuple[Optional[Path], str, Dict]]:
+    """Roda as tarefas num pool de jobs processos (com no maximo CONVERSOES_SIMULTANEAS conversoes ao mesmo tempo).
+    Resultado na ordem das tarefas."""
+    resultados: List[Tuple[Optional[Path], str, Dict]] = [(None, "", {})] * len(tarefas)
+    fila = multiprocessing.Queue()
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=_inicializar_worker_empresa, initargs=(_fila_perfis(), fila)
+    ) as pool:
+        # Dentro de cada empresa a leitura fica serial: o paralelismo ja esta entre empresas.
+        futuros = {
+            pool.submit(_processar_empresa_isolada, dict(t, processos_leitura=1), tag): i
+            for i, (t, tag) in enumerate(zip(tarefas, tags))
+        }
+        pendentes = set(futuros)
+        while pendentes:
+            feitos, pendentes = wait(pendentes, timeout=0.2, return_when=FIRST_COMPLETED)
+            _drenar_fila_log(fila)
+            for fut in feitos:
+                i = futuros[fut]
+                try:
+                    resultados[i] = fut.result()
+                except Exception as exc:
+                    if isinstance(exc, BrokenProcessPool):
+                        _descartar_fila_perfis()
+                    log(f"[{tags[i]}] [ERRO] {exc}")
+                    resultados[i] = (None, f"[ERRO] {exc}", {})
+    _drenar_fila_log(fila)
+    return resultados
+
+
+def _processar_tarefas(tarefas: List[Dict], jobs: int, tags: List[str]) -> List[Tuple[Optional[Path], str, Dict]]:
+    """
+    Em paralelo com jobs > 1 (seguindo em serie se o pool falhar); resultado na ordem das tarefas:
+    (Excel ou None, ultima mensagem de erro/pulo, registro de metricas).
+    """
+    if jobs > 1 and len(tarefas) > 1:
+        log(f"Processando {len(tarefas)} tarefa(s) em paralelo ({min(jobs, len(tarefas))} processos)")
+        try:
+            return _processar_em_paralelo(tarefas, min(jobs, len(tarefas)), tags)
+        except Exception as exc:
+            log(f"[AVISO] Execucao paralela indisponivel, seguindo em serie: {exc}")
+    return [_executar_empresa(t) for t in tarefas]
+
+
+def _tarefas_do_mes(
+    mes_ano: str, empresas: List[str], usar_cache: bool, forcar: bool
+) -> Optional[Tuple[List[Dict], Dict[str, Tuple[Optional[Path], str]], List[str]]]:
+    """
+    Parametros de processar_empresa de cada empresa do mes, resultado das empresas ja puladas na montagem
+    e ordem do resumo. None se a pasta base do mes nao existe.
+    """
     empresas_cfg = carregar_empresas_cfg(mes_ano)
+    tarefas: List[Dict] = []
+    pulados: Dict[str, Tuple[Optional[Path], str]] = {}
 
     # Se ini define empresas com caminhos especificos, usa eles.
     if empresas_cfg:
@@ -725,21 +2790,26 @@ def run_conciliacao(mes_ano: str, empresas: List[str]):
             conf = empresas_cfg.get(emp)
             if not conf:
                 log(f"[PULADO] Empresa nao configurada no ini: {emp}")
+                pulados[emp] = (None, "[PULADO] Empresa nao configurada no ini")
                 continue
             base_dir = conf.get("base_dir") or ""
             if not base_dir:
                 log(f"[PULADO] Base nao informada para {emp}")
+                pulados[emp] = (None, "[PULADO] Base nao informada")
                 continue
             log(f"Base: {base_dir}")
-            processar_empresa(
-                emp,
-                base_dir,
-                mes_ano,
-                arquivo_dom=conf.get("arquivo_dom"),
-                arquivo_emp=conf.get("arquivo_emp"),
+            tarefas.append(
+                dict(
+                    empresa=emp,
+                    pasta_base=base_dir,
+                    mes_ano=mes_ano,
+                    arquivo_dom=conf.get("arquivo_dom"),
+                    arquivo_emp=conf.get("arquivo_emp"),
+                    usar_cache=usar_cache,
+                    forcar=forcar,
+                )
             )
-        log("Fim")
-        return
+        return tarefas, pulados, alvo
 
     # Fallback antigo (usa caminhos_base + subpastas)
     base = None
@@ -749,18 +2819,152 @@ def run_conciliacao(mes_ano: str, empresas: List[str]):
             break
     if not base:
         log("[ERRO FATAL] Pasta base nao encontrada.")
-        return
+        return None
     log(f"Base: {base}")
-    for emp in empresas:
-        processar_empresa(emp, base, mes_ano)
+    tarefas = [
+        dict(empresa=emp, pasta_base=base, mes_ano=mes_ano, usar_cache=usar_cache, forcar=forcar) for emp in empresas
+    ]
+    return tarefas, pulados, empresas
+
+
+def run_conciliacao(
+    mes_ano: str,
+    empresas: List[str],
+    usar_cache: bool = True,
+    jobs: Optional[int] = None,
+    forcar: bool = False,
+    metricas: bool = False,
+) -> Dict[str, Tuple[Optional[Path], str]]:
+    """
+    Concilia as empresas do mes. Com jobs > 1, processa varias empresas ao mesmo tempo em processos separados.
+    forcar refaz mesmo as empresas cujo Excel ainda vale (manifesto da execucao); metricas loga a tabela por etapa no fim.
+    Retorna empresa -> (Excel gerado ou None, ultima mensagem de erro/pulo).
+    """
+    log(f"Iniciando conciliacao [{mes_ano}]")
+    jobs = EMPRESAS_SIMULTANEAS if jobs is None else jobs
+    # Indice de pastas novo a cada execucao (arquivos podem ter mudado desde a anterior).
+    limpar_indice_pastas()
+
+    montagem = _tarefas_do_mes(mes_ano, empresas, usar_cache, forcar)
+    if montagem is None:
+        return {}
+    tarefas, resultados, ordem = montagem
+    saidas = _processar_tarefas(tarefas, jobs, [t["empresa"] for t in tarefas])
+    resultados.update({t["empresa"]: (saida, erro) for t, (saida, erro, _) in zip(tarefas, saidas)})
+    # Resumo na ordem pedida, independente da ordem de termino dos processos.
+    resultados = {emp: resultados[emp] for emp in ordem if emp in resultados}
+
+    if len(resultados) > 1:
+        log("Resumo da execucao:")
+        for emp, (saida, erro) in resultados.items():
+            if saida:
+                log(f"  {emp}: OK ({Path(saida).name})")
+            else:
+                log(f"  {emp}: FALHA {erro}".rstrip())
+    if metricas:
+        resumo_metricas([reg for _, _, reg in saidas if reg])
     log("Fim")
+    return resultados
+
+
+def meses_entre(inicio: str, fim: str) -> List[str]:
+    """Meses de inicio a fim (inclusive) no formato MM-AAAA. ValueError se algum nao estiver nesse formato."""
+    def indice(mes_ano: str) -> int:
+        mes, ano = mes_ano.strip().split("-")
+        if not 1 <= int(mes) <= 12:
+            raise ValueError(f"Mes invalido: {mes_ano}")
+        return int(ano) * 12 + int(mes) - 1
+
+    if indice(fim) < indice(inicio):
+        raise ValueError(f"{fim} e anterior a {inicio}")
+    return [f"{i % 12 + 1:02d}-{i // 12}" for i in range(indice(inicio), indice(fim) + 1)]
+
+
+def _situacao(resultado: Optional[Tuple[Optional[Path], str]]) -> str:
+    if resultado is None:
+        return "-"
+    saida, erro = resultado
+    if saida:
+        return "OK"
+    return "PULADO" if erro.startswith("[PULADO") else "FALHA"
+
+
+def run_lote(
+    meses: List[str],
+    empresas: List[str],
+    usar_cache: bool = True,
+    jobs: Optional[int] = None,
+    forcar: bool = False,
+    metricas: bool = False,
+) -> Dict[Tuple[str, str], Tuple[Optional[Path], str]]:
+    """
+    Concilia varios meses x empresas num unico pool de processos: importacoes e config carregadas uma vez por worker,
+    ate jobs tarefas (mes, empresa) ao mesmo tempo e no maximo CONVERSOES_SIMULTANEAS conversoes LibreOffice entre todas.
+    As tarefas sao independentes (cada uma grava so a propria pasta Conciliacao). No fim loga a matriz empresa x mes.
+    Retorna (mes, empresa) -> (Excel gerado ou None, ultima mensagem de erro/pulo).
+    """
+    log(f"Iniciando lote: {len(meses)} mes(es) x {len(empresas) or 'todas as'} empresa(s)")
+    jobs = EMPRESAS_SIMULTANEAS if jobs is None else jobs
+    limpar_indice_pastas()
+
+    tarefas: List[Dict] = []
+    resultados: Dict[Tuple[str, str], Tuple[Optional[Path], str]] = {}
+    ordem: List[str] = []
+    for mes_ano in meses:
+        montagem = _tarefas_do_mes(mes_ano, empresas, usar_cache, forcar)
+        if montagem is None:
+            for emp in empresas:
+                resultados[(mes_ano, emp)] = (None, "[ERRO FATAL] Pasta base nao encontrada.")
+            ordem += [e for e in empresas if e not in ordem]
+            continue
+        tarefas_mes, pulados, ordem_mes = montagem
+        tarefas += tarefas_mes
+        resultados.update({(mes_ano, emp): r for emp, r in pulados.items()})
+        ordem += [e for e in ordem_mes if e not in ordem]
+
+    saidas = _processar_tarefas(tarefas, jobs, [f"{t['empresa']} {t['mes_ano']}" for t in tarefas])
+    resultados.update({(t["mes_ano"], t["empresa"]): (saida, erro) for t, (saida, erro, _) in zip(tarefas, saidas)})
+
+    log("Matriz da execucao (empresa x mes):")
+    largura = max([len("Empresa")] + [len(e) for e in ordem])
+    log("  " + " | ".join(["Empresa".ljust(largura)] + [m.ljust(7) for m in meses]))
+    for emp in ordem:
+        celulas = [_situacao(resultados.get((m, emp))).ljust(7) for m in meses]
+        log("  " + " | ".join([emp.ljust(largura)] + celulas))
+    if metricas:
+        resumo_metricas([reg for _, _, reg in saidas if reg])
+    ok = sum(1 for saida, _ in resultados.values() if saida)
+    log(f"Fim do lote: {ok} de {len(resultados)} conciliacao(oes) OK")
+    return resultados
 
 
 if __name__ == "__main__":
-    mes_ano_cli = sys.argv[1] if len(sys.argv) > 1 else MES_ANO_DEFAULT
-    empresas_cli = sys.argv[2:] if len(sys.argv) > 2 else []
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(description="Conciliacao Dominio x Empresa")
+    parser.add_argument("mes_ano", nargs="?", default=MES_ANO_DEFAULT, help="Mes/ano da pasta (ex.: 11-2025)")
+    parser.add_argument("empresas", nargs="*", help="Empresas a conciliar (padrao: todas do config.ini)")
+    parser.add_argument("--sem-cache", action="store_true", help="Nao usa o cache de relatorios preparados")
+    parser.add_argument("--limpar-cache", action="store_true", help="Apaga o cache de relatorios preparados antes de rodar")
+    parser.add_argument("--ate", default=None, help="Lote: concilia de mes_ano ate este mes (MM-AAAA) num unico pool")
+    parser.add_argument("--metricas", action="store_true", help="Mostra no fim a tabela de tempo/linhas/MB por etapa")
+    parser.add_argument("--forcar", action="store_true", help="Refaz a conciliacao mesmo sem mudanca nas entradas")
+    parser.add_argument("--jobs", type=int, default=None, help="Empresas processadas ao mesmo tempo (padrao: EMPRESAS_SIMULTANEAS do ini)")
+    args = parser.parse_args()
+
+    if args.limpar_cache:
+        log(f"Cache de relatorios limpo: {limpar_cache_relatorios()} arquivo(s) removido(s).")
+    mes_ano_cli = args.mes_ano
+    empresas_cli = args.empresas
     if not empresas_cli and CFG.has_section("empresas"):
         empresas_cli = list(CFG["empresas"].values())
     if not empresas_cli:
         empresas_cli = ["DROGARIA LIMEIRA", "DROGARIA MORELLI FILIAL", "DROGARIA MORELLI MTZ"]
-    run_conciliacao(mes_ano_cli, empresas_cli)
+    opcoes = dict(usar_cache=not args.sem_cache, jobs=args.jobs, forcar=args.forcar, metricas=args.metricas)
+    if args.ate:
+        try:
+            meses_cli = meses_entre(mes_ano_cli, args.ate)
+        except ValueError:
+            parser.error(f"Intervalo de meses invalido: {mes_ano_cli} a {args.ate} (use MM-AAAA)")
+        run_lote(meses_cli, empresas_cli, **opcoes)
+    else:
+        run_conciliacao(mes_ano_cli, empresas_cli, **opcoes)
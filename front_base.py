@@ -11,6 +11,7 @@ import configparser
 from utils import resource_path
 
 INI_PATH = Path(resource_path("config.ini"))
+OPCAO_TODAS = "Todas as empresas"
 
 
 class ConfigError(RuntimeError):
@@ -29,6 +30,9 @@ def carregar_empresas():
     for nome_empresa in cfg["EMPRESAS"].keys():
         # usa a chave como nome exibido; valor e caminho eh usado apenas no backend
         empresas[nome_empresa] = nome_empresa
+    if len(empresas) > 1:
+        # processa todas as empresas do ini (em paralelo conforme EMPRESAS_SIMULTANEAS)
+        empresas[OPCAO_TODAS] = OPCAO_TODAS
     return empresas
 
 
@@ -1,4 +1,6 @@
-from front_base import criar_janela
+import multiprocessing
+
+from front_base import OPCAO_TODAS, criar_janela
 from conciliacao import run_conciliacao
 
 
@@ -6,12 +8,13 @@ def rodar_rpa(codigo, display, mes_ano):
     empresa = display
     app.update_main_label(f"Conciliacao em andamento para {empresa} ({mes_ano})")
     app.update_progress(app.overall_progress, 5)
-    run_conciliacao(mes_ano, [empresa])
+    run_conciliacao(mes_ano, [] if empresa == OPCAO_TODAS else [empresa])
     app.update_progress(app.overall_progress, 100)
     app.update_main_label("Processo finalizado.")
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # leitura paralela dos relatorios no executavel (PyInstaller)
     root, app = criar_janela(rodar_rpa, titulo="Conciliacao Dominio x Empresa")
     app.start_rpa_button.config(text="Gerar Conciliacao")
     root.mainloop()